@@ -0,0 +1,46 @@
+import numpy as np
+try:
+    # numba is optional, the kernels fall back to (vectorized) numpy code
+    import numba
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+def _off_diagonal_stats_numpy(distances : np.ndarray) -> tuple[int, float, int]:
+    # off-diagonal elements of the matrix, as a view (i.e., without copying them): skipping the first
+    # element, each diagonal element is the last one of a block of n + 1 contiguous elements
+    n = distances.shape[0]
+    off_diagonal = np.ascontiguousarray(distances).ravel()[1:].reshape(n - 1, n + 1)[:, :-1]
+    return off_diagonal.min(), off_diagonal.mean(), off_diagonal.max()
+
+if _HAS_NUMBA:
+    @numba.njit(cache=True)
+    def _off_diagonal_stats_numba(distances):
+        # a single fused pass computing all the statistics
+        n = distances.shape[0]
+        minimum = maximum = distances[0, 1]
+        total = 0
+        for i in range(n):
+            for j in range(n):
+                if i != j:
+                    v = distances[i, j]
+                    total += v
+                    if v < minimum:
+                        minimum = v
+                    elif v > maximum:
+                        maximum = v
+        return minimum, total / (n * n - n), maximum
+
+def off_diagonal_stats(distances : np.ndarray) -> tuple[int, float, int]:
+    """
+    Minimum, average and maximum of the off-diagonal elements of a square matrix.
+
+    Parameters:
+    - distances (np.ndarray): The (integer) square matrix, with at least two rows.
+
+    Returns:
+    - tuple: The minimum, the average and the maximum.
+    """
+    if _HAS_NUMBA:
+        return _off_diagonal_stats_numba(distances)
+    return _off_diagonal_stats_numpy(distances)
@@ -0,0 +1,91 @@
+import json
+import os
+from pathlib import Path
+import shapely as sp
+from concurrent.futures import ThreadPoolExecutor
+import click
+from ._utils import find_osm_bounds, list_osm_files, verify_digest, MAX_IO_WORKERS
+
+INDEX_FILENAME = '.osm_index.json'
+
+def load_index(data_dir : Path) -> dict:
+    """
+    Load the index of the OSM files bounds stored in the data directory.
+
+    Parameters:
+    - data_dir (Path): The data directory.
+
+    Returns:
+    - dict: A mapping from file name to its stat signature (mtime_ns, size) and bounds.
+    """
+    try:
+        with open(data_dir / INDEX_FILENAME) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_index(data_dir : Path, index : dict):
+    """
+    Save the index of the OSM files bounds into the data directory.
+
+    Parameters:
+    - data_dir (Path): The data directory.
+    - index (dict): The index, as returned by load_index.
+    """
+    temp_file = data_dir / (INDEX_FILENAME + '.tmp')
+    with open(temp_file, 'w') as f:
+        json.dump(index, f)
+    temp_file.replace(data_dir / INDEX_FILENAME)
+
+def index_file(data_dir : Path, file : Path):
+    """
+    Record in the index the bounds of a file just downloaded into the data directory, whose digest
+    has been computed while downloading it, so that it is not read again when the areas are listed.
+
+    Parameters:
+    - data_dir (Path): The data directory.
+    - file (Path): The downloaded OSM file.
+    """
+    index = load_index(data_dir)
+    index[file.name] = _stat_entry(file.stat(), find_osm_bounds(file))
+    save_index(data_dir, index)
+
+def osm_areas(data_dir : Path) -> list[tuple[Path, os.stat_result, sp.Polygon]]:
+    """
+    List the OSM files available in the data directory together with their stat information and bounds.
+    Files are parsed only when they are not in the index or their stat signature changed.
+
+    Parameters:
+    - data_dir (Path): The data directory.
+
+    Returns:
+    - list: A list of (file, stat, bounds) triples, bounds being None if the file has no <bounds> element
+      (or it does not match the digest recorded when it was downloaded).
+    """
+    index = load_index(data_dir)
+    files = list_osm_files(data_dir)
+    if not files:
+        return []
+    # parsing (and decompressing) the files is I/O bound, so it can be overlapped
+    with ThreadPoolExecutor(max_workers=min(MAX_IO_WORKERS, len(files))) as executor:
+        entries = list(executor.map(lambda f: _index_entry(*f, index.get(f[0].name)), files))
+    updated_index = { file.name: entry for (file, _), (entry, _) in zip(files, entries) }
+    if updated_index != index:
+        save_index(data_dir, updated_index)
+    return [(file, stat, sp.box(*bounds) if bounds is not None else None) for (file, stat), (_, bounds) in zip(files, entries)]
+
+def _stat_entry(stat : os.stat_result, bbox : sp.Polygon) -> dict:
+    return { 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'bounds': list(bbox.bounds) if bbox is not None else None }
+
+def _index_entry(file : Path, stat : os.stat_result, entry : dict) -> tuple[dict, list]:
+    # the entry to store in the index and the bounds of the file
+    if entry is not None:
+        if entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            return entry, entry['bounds']
+        # the file changed since it was indexed, check that it is not corrupted (e.g., truncated) before parsing it
+        if not verify_digest(file):
+            click.secho(f'Warning: {file.name} does not match the digest recorded when it was downloaded, it is likely corrupted', fg='yellow', err=True)
+            # the former entry is kept, so that the file is verified (and reported) again until it is replaced
+            return entry, None
+    entry = _stat_entry(stat, find_osm_bounds(file))
+    return entry, entry['bounds']
@@ -1,18 +1,54 @@
 import requests
-from pyproj import CRS
+from pyproj import CRS, Transformer
 from math import floor
-import xml.etree.ElementTree as ET
 import shapely as sp
 import subprocess
 from pathlib import Path
+import os
 import bz2
 import click
 import tempfile
 import zipfile
 import geopandas as gpd
 import pandas as pd
+import numpy as np
 import country_converter as coco 
 import io
+import shutil
+import functools
+import json
+import time
+import struct
+import zlib
+import queue
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+try:
+    # lxml is considerably faster than the standard library on large OSM files
+    from lxml import etree as ET
+    _HAS_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _HAS_LXML = False
+try:
+    # xxhash is considerably faster than the cryptographic hashes of the standard library
+    import xxhash
+    _HAS_XXHASH = True
+except ImportError:
+    _HAS_XXHASH = False
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+OSM_HEADER_SIZE = 1 << 16
+MAX_IO_WORKERS = 8
+# the suffixes of the supported OSM files
+OSM_SUFFIXES = ('.osm', '.osm.bz2', '.osm.pbf')
+# maximum number of downloaded chunks waiting to be compressed
+MAX_PENDING_CHUNKS = 16
+# the suffix of the sidecar files storing the digest of the downloaded OSM files
+DIGEST_SUFFIX = '.digest'
+GEOCODE_CACHE_FILENAME = '.geocode_cache.json'
+GEOCODE_CACHE_TTL = 30 * 24 * 60 * 60
 
 class DataDownloadError(Exception):
     pass
@@ -34,13 +70,79 @@ def find_appropriate_crs(latitude, longitude):
 
     # Calculate the UTM zone number for a given longitude.
     utm_zone = floor((longitude + 180) / 6) + 1
-    hemisphere = 'north' if latitude >= 0 else 'south'
-    crs = CRS(f"EPSG:326{utm_zone}") if hemisphere == 'north' else CRS(f"EPSG:327{utm_zone}")
-    return crs
+    return _utm_crs(utm_zone, latitude >= 0)
+
+@functools.lru_cache(maxsize=128)
+def _utm_crs(utm_zone : int, north : bool) -> CRS:
+    return CRS(f"EPSG:326{utm_zone:02d}") if north else CRS(f"EPSG:327{utm_zone:02d}")
+
+@functools.lru_cache(maxsize=128)
+def get_transformer(source_crs, target_crs) -> Transformer:
+    """
+    Get a (cached) transformer between two CRSs, with the traditional GIS order of coordinates (i.e., lon, lat).
+
+    Parameters:
+    - source_crs: The source CRS (anything accepted by pyproj.CRS.from_user_input).
+    - target_crs: The target CRS (anything accepted by pyproj.CRS.from_user_input).
+
+    Returns:
+    - Transformer: A pyproj Transformer object.
+    """
+    return Transformer.from_crs(source_crs, target_crs, always_xy=True)
+
+def geocode(city : str, data_dir : Path, provider : str='nominatim', user_agent : str=None) -> gpd.GeoDataFrame:
+    """
+    Geocode a city, caching the results in the data directory for GEOCODE_CACHE_TTL seconds
+    (geocoding services are rate limited and take seconds to answer).
+
+    Parameters:
+    - city (str): The city to geocode.
+    - data_dir (Path): The data directory where the cache is stored.
+    - provider (str): The geocoding provider.
+    - user_agent (str): The user agent to identify with the provider.
+
+    Returns:
+    - GeoDataFrame: A GeoDataFrame (in EPSG:4326) with the address and the location of the city.
+    """
+    cache_file = data_dir / GEOCODE_CACHE_FILENAME
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    key = f"{provider}:{' '.join(city.lower().split())}"
+    entry = cache.get(key)
+    if entry is None or time.time() - entry['timestamp'] > GEOCODE_CACHE_TTL:
+        res = gpd.tools.geocode(city, provider=provider, user_agent=user_agent)
+        res.set_crs(epsg=4326, inplace=True)
+        location = res.iloc[0].geometry
+        # do not cache failed lookups
+        if location is None or location.is_empty:
+            return res
+        entry = { 'address': res.iloc[0].address, 'location': [location.x, location.y], 'timestamp': time.time() }
+        cache[key] = entry
+        data_dir.mkdir(parents=True, exist_ok=True)
+        with open(cache_file, 'w') as f:
+            json.dump(cache, f)
+    return gpd.GeoDataFrame({ 'address': [entry['address']] }, geometry=[sp.Point(*entry['location'])], crs='EPSG:4326')
+
+# Overpass statements selecting the elements to download: 'routing' keeps only what the OSRM car profile
+# uses (highways, ferries, their nodes and turn restrictions), 'all' downloads every element in the area
+OVERPASS_FILTERS = {
+    'routing': """
+    (way["highway"];way["route"="ferry"];)->.ways;
+    (.ways;node(w.ways);rel["type"="restriction"];);
+    """,
+    'all': """
+    (node;way;rel;);
+    """
+}
 
-def download_osm_data(west : float, south : float, east : float, north : float, output_filename : Path=Path('map.osm'), bzip : bool=False):
+def download_osm_data(west : float, south : float, east : float, north : float, output_filename : Path=Path('map.osm'), bzip : bool=False, osm_filter : str='routing'):
     """
-    Download OSM data for a specified bounding box and save it as a .pbf file.
+    Download OSM data for a specified bounding box and save it as an .osm (XML) file.
+    The Overpass API does not provide PBF output, .osm.pbf extracts obtained elsewhere
+    (e.g., from Geofabrik) can be placed directly in the data directory.
 
     Parameters:
     - west (float): Western longitude of the bounding box.
@@ -49,50 +151,325 @@ def download_osm_data(west : float, south : float, east : float, north : float,
     - north (float): Northern latitude of the bounding box.
     - output_filename (Path): Name of the file to save the downloaded data to.
     - bzip (bool): Whether to compress the output file with bzip2.
+    - osm_filter (str): The elements to download, one of the keys of OVERPASS_FILTERS.
+
+
+    Returns:
+    - Path: The name of the file the data have been saved to (with the .bz2 suffix, if compressed).
     """
     overpass_url = "http://overpass-api.de/api/interpreter"
     overpass_query = f"""
-    [out:xml][maxsize:2000000000][timeout:60][bbox:{south},{west},{north},{east}];
-    (node;way;rel;);
-    out meta;
+    [out:xml][maxsize:2000000000][timeout:60][bbox:{south},{west},{north},{east}];{OVERPASS_FILTERS[osm_filter]}out meta;
     """
-    response = requests.get(overpass_url, params={'data': overpass_query})
-    if response.status_code == 200:
-        if bzip:
-            if output_filename.suffix != '.bz2':
-                output_filename = output_filename.with_suffix(output_filename.suffix + '.bz2')
-            open_func = bz2.open
-        else:
-            open_func = open
-        with open_func(output_filename, 'wb') as file:
-            file.write(response.content)
-    else:
-        raise DataDownloadError(f"Error downloading data from {overpass_url}: {response.status_code} {response.reason}")
+    with requests.get(overpass_url, params={'data': overpass_query}, stream=True, timeout=(10, 600)) as response:
+        if response.status_code != 200:
+            raise DataDownloadError(f"Error downloading data from {overpass_url}: {response.status_code} {response.reason}")
+        if bzip and output_filename.suffix != '.bz2':
+            output_filename = output_filename.with_suffix(output_filename.suffix + '.bz2')
+        # stream the payload to disk (possibly compressing on the fly) rather than keeping it in memory,
+        # the data are written to a temporary file, so that an interrupted download never looks like a complete one
+        response.raw.decode_content = True
+        temp_filename = output_filename.with_name(output_filename.name + '.part')
+        algorithm, digest = _new_digest()
+        try:
+            with open(temp_filename, 'wb') as raw_file:
+                # the digest is computed on the bytes actually written to disk
+                file = _HashingWriter(raw_file, digest)
+                if bzip:
+                    # bzip2 compression is CPU bound, so it runs in a separate thread overlapping with the download
+                    with bz2.open(file, 'wb', compresslevel=3) as bzip_file:
+                        _copy_in_background(response.raw, bzip_file)
+                else:
+                    shutil.copyfileobj(response.raw, file, length=DOWNLOAD_CHUNK_SIZE)
+            os.replace(temp_filename, output_filename)
+        finally:
+            temp_filename.unlink(missing_ok=True)
+        write_digest(output_filename, algorithm, digest.hexdigest())
+    return output_filename
+
+class _HashingWriter:
+    # A minimal writable file-like object updating a digest with the data written to the underlying file
+    def __init__(self, file, digest):
+        self._file = file
+        self._digest = digest
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+def _new_digest(algorithm : str=None):
+    if algorithm is None:
+        algorithm = 'xxh3_64' if _HAS_XXHASH else 'blake2b'
+    if algorithm == 'xxh3_64':
+        return algorithm, xxhash.xxh3_64() if _HAS_XXHASH else None
+    if algorithm == 'blake2b':
+        return algorithm, hashlib.blake2b(digest_size=16)
+    return algorithm, None
+
+def _digest_file(filename : Path) -> Path:
+    return filename.with_name(filename.name + DIGEST_SUFFIX)
+
+def write_digest(filename : Path, algorithm : str, digest : str):
+    """
+    Store the digest of a file in its sidecar file.
+
+    Parameters:
+    - filename (Path): The path to the file.
+    - algorithm (str): The name of the hash algorithm.
+    - digest (str): The hexadecimal digest.
+    """
+    _digest_file(filename).write_text(f'{algorithm} {digest}\n')
+
+def verify_digest(filename : Path) -> bool:
+    """
+    Verify a file against the digest stored in its sidecar file (if any) when it was downloaded.
+
+    Parameters:
+    - filename (Path): The path to the file.
+
+    Returns:
+    - bool: False if the content of the file does not match the stored digest, True otherwise 
+      (including when no digest is available or its algorithm is not supported).
+    """
+    try:
+        algorithm, expected = _digest_file(filename).read_text().split()
+    except (FileNotFoundError, ValueError):
+        return True
+    algorithm, digest = _new_digest(algorithm)
+    if digest is None:
+        return True
+    with open(filename, 'rb') as f:
+        while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+def remove_digest(filename : Path):
+    """
+    Remove the sidecar file storing the digest of a file (if any).
+
+    Parameters:
+    - filename (Path): The path to the file.
+    """
+    _digest_file(filename).unlink(missing_ok=True)
+
+def _copy_in_background(src, dst, length : int=DOWNLOAD_CHUNK_SIZE):
+    """
+    Copy the content of the file-like object src to dst, writing to dst in a background thread.
+    At most MAX_PENDING_CHUNKS chunks are kept in memory while waiting to be written.
+
+    Parameters:
+    - src: The file-like object to read from.
+    - dst: The file-like object to write to.
+    - length (int): The size of the chunks.
+    """
+    chunks = queue.Queue(maxsize=MAX_PENDING_CHUNKS)
+    failed = threading.Event()
+    def writer():
+        try:
+            while (chunk := chunks.get()) is not None:
+                dst.write(chunk)
+        except BaseException:
+            # tell the reader to stop and keep consuming so that it is never blocked on a full queue
+            failed.set()
+            while chunks.get() is not None:
+                pass
+            raise
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        written = executor.submit(writer)
+        try:
+            while not failed.is_set() and (chunk := src.read(length)):
+                chunks.put(chunk)
+        finally:
+            chunks.put(None)
+        written.result()
 
 def find_osm_bounds(filename : Path):
-    if '.bz2' in filename.suffixes:
-        open_func = bz2.open
-    else:
-        open_func = open    
-    with open_func(filename, 'rb') as f:
-        # Create an iterator for the XML file
-        context = ET.iterparse(f, events=('start', 'end'))
-
-        # Skip the root element
-        _, root = next(context)
-
-        # Process each element in the XML file
-        for event, element in context:
-            if event == 'end' and element.tag == 'bounds':
-                # Process the <bounds> element
+    """
+    Find the bounding box of an OSM file, memoizing the result as long as the file is unchanged.
+
+    Parameters:
+    - filename (Path): The path to the OSM file (possibly bzip2 compressed).
+
+    Returns:
+    - Polygon: The bounding box of the data, or None if the file has no <bounds> element.
+    """
+    stat = filename.stat()
+    return _find_osm_bounds(filename, stat.st_mtime_ns, stat.st_size)
+
+def _parse_osm_bounds(f, partial : bool=False):
+    options = { 'huge_tree': True } if _HAS_LXML else {}
+    try:
+        for _, element in ET.iterparse(f, events=('end',), **options):
+            if element.tag == 'bounds':
                 res = element.attrib
                 return sp.box(float(res['minlon']), 
                               float(res['minlat']), 
                               float(res['maxlon']), 
                               float(res['maxlat']))
-
             # Clear the processed elements from memory
-            root.clear()
+            element.clear()
+            if _HAS_LXML:
+                # lxml keeps the references to the previous siblings, get rid of them as well
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+    except ET.ParseError:
+        # a partial document is expected to end abruptly
+        if not partial:
+            raise
+
+def _protobuf_fields(data : bytes):
+    # Minimal protocol buffers decoder, yielding (field number, value) pairs
+    pos = 0
+    while pos < len(data):
+        key, pos = _protobuf_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _protobuf_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = _protobuf_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protocol buffers wire type {wire_type}")
+        yield field, value
+
+def _protobuf_varint(data : bytes, pos : int):
+    result, shift = 0, 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def _find_pbf_bounds(filename : Path):
+    # The first blob of an OSM PBF file is the OSMHeader, which contains the bounding box
+    # (see https://wiki.openstreetmap.org/wiki/PBF_Format), so only a few bytes are read
+    with open(filename, 'rb') as f:
+        header_size, = struct.unpack('>I', f.read(4))
+        blob_header = dict(_protobuf_fields(f.read(header_size)))
+        if blob_header.get(1) != b'OSMHeader':
+            return None
+        blob = dict(_protobuf_fields(f.read(blob_header[3])))
+    if 1 in blob:
+        header_block = blob[1]
+    elif 3 in blob:
+        header_block = zlib.decompress(blob[3])
+    else:
+        raise ValueError(f"Unsupported compression of the OSMHeader blob in {filename}")
+    bbox = dict(_protobuf_fields(dict(_protobuf_fields(header_block)).get(1, b'')))
+    if not bbox:
+        return None
+    # coordinates are stored as zigzag-encoded nanodegrees (left, right, top, bottom)
+    left, right, top, bottom = ((bbox[i] >> 1) ^ -(bbox[i] & 1) for i in (1, 2, 3, 4))
+    return sp.box(left * 1e-9, bottom * 1e-9, right * 1e-9, top * 1e-9)
+
+def _open_osm_file(filename : Path):
+    if filename.name.endswith('.bz2'):
+        return bz2.open(filename, 'rb')
+    return open(filename, 'rb')
+
+@functools.lru_cache(maxsize=64)
+def _read_osm_header(filename : Path, mtime_ns : int) -> bytes:
+    # The first (decompressed) bytes of an OSM XML file, which contain the <bounds> element in general
+    with _open_osm_file(filename) as f:
+        return f.read(OSM_HEADER_SIZE)
+
+@functools.lru_cache(maxsize=128)
+def _find_osm_bounds(filename : Path, mtime_ns : int, size : int):
+    if filename.name.endswith('.pbf'):
+        return _find_pbf_bounds(filename)
+    # The <bounds> element comes right after the <osm> root element, so in general
+    # it is enough to parse the beginning of the file (avoiding to decompress it all)
+    bounds = _parse_osm_bounds(io.BytesIO(_read_osm_header(filename, mtime_ns)), partial=True)
+    if bounds is None:
+        with _open_osm_file(filename) as f:
+            bounds = _parse_osm_bounds(f)
+    return bounds
+
+def _is_osm_file(name : str) -> bool:
+    return name.endswith(OSM_SUFFIXES)
+
+def osm_base_name(name : str) -> str:
+    """
+    The name of an OSM file without its suffixes (e.g., 'Udine-5km' for 'Udine-5km.osm.bz2'),
+    which is also the base name of the OSRM files derived from it.
+
+    Parameters:
+    - name (str): The name of the OSM file.
+
+    Returns:
+    - str: The base name.
+    """
+    return name.split('.osm')[0]
+
+def list_osm_files(data_dir : Path) -> list[tuple[Path, os.stat_result]]:
+    """
+    List the OSM files in a directory, together with their stat information.
+
+    Parameters:
+    - data_dir (Path): The directory.
+
+    Returns:
+    - list[tuple[Path, os.stat_result]]: The files and their stat information.
+    """
+    with os.scandir(data_dir) as it:
+        # the stat information of the directory entries is cached by scandir
+        return [(Path(entry.path), entry.stat()) for entry in it if entry.is_file() and _is_osm_file(entry.name)]
+
+def list_route_dirs(data_dir : Path) -> list[Path]:
+    """
+    List the OSRM routes directories in a directory.
+
+    Parameters:
+    - data_dir (Path): The directory.
+
+    Returns:
+    - list[Path]: The routes directories.
+    """
+    with os.scandir(data_dir) as it:
+        return [Path(entry.path) for entry in it if entry.is_dir() and entry.name.endswith('-routes')]
+
+def directory_size(path : Path) -> int:
+    """
+    Compute the total size of the files in a directory (recursively).
+
+    Parameters:
+    - path (Path): The directory.
+
+    Returns:
+    - int: The size in bytes.
+    """
+    size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                size += directory_size(entry.path)
+            else:
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+def directories_size(paths : list[Path]) -> list[int]:
+    """
+    Compute the total size of the files in each of the given directories, overlapping the stat calls.
+
+    Parameters:
+    - paths (list[Path]): The directories.
+
+    Returns:
+    - list[int]: The sizes in bytes, in the same order of paths.
+    """
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_IO_WORKERS, len(paths))) as executor:
+        return list(executor.map(directory_size, paths))
 
 def run_osrm_process(command : str, args : list[str]):
     """
@@ -102,51 +479,120 @@ def run_osrm_process(command : str, args : list[str]):
     - command (str): The OSRM backend command to run (e.g., 'osrm-extract').
     - args (list): A list of arguments to pass to the command.
     """
+    # the (verbose) progress log is discarded, only the error output is kept for reporting failures
     try:
-        subprocess.run([command] + args, check=True)
+        subprocess.run([command] + args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
     except subprocess.CalledProcessError as e:
-        raise OSRMProcessingError(f"Error running {command}: {e}")
+        stderr = e.stderr.decode(errors='replace').strip() if e.stderr else ''
+        raise OSRMProcessingError(f"Error running {command}: {e}" + (f"\n{stderr}" if stderr else ''))
 
-def prepare_osrm_data(osm_file_path : Path, profile_path : Path=None):
+def prepare_osrm_data(osm_file_path : Path, profile_path : Path=None, threads : int=None):
     """
     Prepares an OSM .pbf file for routing with OSRM by extracting, partitioning, and customizing the data.
 
     Parameters:
     - osm_file_path (pathlib.Path): The path to the OSM file.
     - profile_path (pathlib.Path): The path to the OSRM profile file (e.g., car.lua).
+    - threads (int): The number of threads used by each OSRM process (default: all the available cores).
     """
     # due to the way osrm-extract works, we need to link the pbf_file_path to a file in a temporary directory
-    # so that the file can be found by the osrm-extract process
-        
-    with tempfile.TemporaryDirectory() as temp_dir:
-        osm_file_temp_path = Path(temp_dir) / osm_file_path.name
-        osm_file_temp_path.symlink_to(osm_file_path)
+    # so that the file can be found by the osrm-extract process. The temporary directory lives next to the
+    # OSM file, so that the results can be moved to the target directory by renaming (no copies)
+    base_osm_filename = osm_base_name(osm_file_path.name)
+    target_dir = osm_file_path.parent / (base_osm_filename + '-routes')
+    temp_dir = Path(tempfile.mkdtemp(prefix=f'.{base_osm_filename}-', dir=osm_file_path.parent))
+    try:
+        osm_file_temp_path = temp_dir / osm_file_path.name
+        try:
+            os.link(osm_file_path, osm_file_temp_path)
+        except OSError:
+            # hardlinks are not supported by every filesystem
+            osm_file_temp_path.symlink_to(osm_file_path.resolve())
         click.echo(f'Processing {osm_file_temp_path}')
 
         if profile_path is None:
             profile_path = Path(__file__).parent.parent / 'osrm_profiles' / 'car.lua'
+        threads_args = ['--threads', str(threads)] if threads else []
         # Extract
-        run_osrm_process('osrm-extract', ['-p', profile_path, osm_file_temp_path])
+        run_osrm_process('osrm-extract', ['-p', profile_path, osm_file_temp_path] + threads_args)
         
         # The output file from extraction will have the same name but with .osrm extension
-        base_osm_filename = osm_file_path.name.split('.osm')[0]
-        osrm_file_path = Path(temp_dir) / (base_osm_filename + '.osrm')
+        osrm_file_path = temp_dir / (base_osm_filename + '.osrm')
         
         # Partition
-        run_osrm_process('osrm-partition', [osrm_file_path])
+        run_osrm_process('osrm-partition', [osrm_file_path] + threads_args)
         
         # Customize
-        run_osrm_process('osrm-customize', [osrm_file_path])
+        run_osrm_process('osrm-customize', [osrm_file_path] + threads_args)
 
-        # Move the file to the original directory
-        target_dir = osm_file_path.parent / (base_osm_filename + '-routes')
-        target_dir.mkdir(exist_ok=True, parents=True)
-        for file in Path(temp_dir).iterdir():
-            if '.osrm' in file.suffixes:
-                file.rename(target_dir / file.name)
+        # Move the files to the original directory
+        osm_file_temp_path.unlink()
+        if not target_dir.exists():
+            # mkdtemp creates a private directory, the published one gets the default permissions, taken from a
+            # directory created by mkdir (reading the umask would change it for the whole process, meanwhile)
+            probe_dir = temp_dir / '.mode'
+            probe_dir.mkdir()
+            mode = probe_dir.stat().st_mode
+            probe_dir.rmdir()
+            os.chmod(temp_dir, mode & 0o7777)
+            os.replace(temp_dir, target_dir)
+        else:
+            osrm_file_name = osrm_file_path.name
+            with os.scandir(temp_dir) as it:
+                for entry in it:
+                    if entry.name == osrm_file_name or entry.name.startswith(osrm_file_name + '.'):
+                        os.replace(entry.path, target_dir / entry.name)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
-        click.echo(f"Data preparation complete. Ready for routing with data in {target_dir}")
+    click.echo(f"Data preparation complete. Ready for routing with data in {target_dir}")
         
+def load_feather(filename : Path, columns : list[str]=None) -> gpd.GeoDataFrame:
+    """
+    Load a GeoDataFrame from a feather file, memoizing the result as long as the file is unchanged.
+    The returned GeoDataFrame is shared among the callers, hence it must not be modified in place.
+
+    Parameters:
+    - filename (Path): The path to the feather file.
+    - columns (list): The columns to read (default: all the columns).
+
+    Returns:
+    - GeoDataFrame: The content of the file.
+    """
+    return _load_feather(filename, filename.stat().st_mtime_ns, tuple(columns) if columns is not None else None)
+
+@functools.lru_cache(maxsize=4)
+def _load_feather(filename : Path, mtime_ns : int, columns : tuple):
+    return gpd.read_feather(filename, columns=list(columns) if columns is not None else None)
+
+def select_within_distance(gdf : gpd.GeoDataFrame, point : sp.Point, distance : float) -> gpd.GeoDataFrame:
+    """
+    Select the rows of a GeoDataFrame whose geometry is closer than a given distance to a point.
+    The bounding boxes of the geometries are used to decide most of the rows (e.g., the regular cells
+    of a census grid) without computing the exact distance, which is needed only for the geometries
+    whose bounding box crosses the boundary of the circle.
+
+    Parameters:
+    - gdf (GeoDataFrame): The data, in a projected CRS.
+    - point (Point): The center, in the same CRS of the data.
+    - distance (float): The distance (in the units of the CRS).
+
+    Returns:
+    - GeoDataFrame: The selected rows.
+    """
+    gdf = gdf.iloc[np.sort(gdf.sindex.query(sp.box(point.x - distance, point.y - distance, point.x + distance, point.y + distance)))]
+    minx, miny, maxx, maxy = sp.bounds(gdf.geometry.values).T
+    # the distance from the point to the bounding box is a lower bound of the distance to the geometry,
+    # the distance to the farthest corner of the bounding box is an upper bound
+    near = np.hypot(np.maximum.reduce([minx - point.x, point.x - maxx, np.zeros_like(minx)]), 
+                    np.maximum.reduce([miny - point.y, point.y - maxy, np.zeros_like(miny)]))
+    far = np.hypot(np.maximum(np.abs(minx - point.x), np.abs(maxx - point.x)), 
+                   np.maximum(np.abs(miny - point.y), np.abs(maxy - point.y)))
+    selected = far < distance
+    undecided = ~selected & (near < distance)
+    selected[undecided] = gdf.geometry.values[undecided].distance(point) < distance
+    return gdf[selected]
+
 def download_population_density(filename : Path):
     url = 'https://gisco-services.ec.europa.eu/census/2021/Eurostat_Census-GRID_2021_V1-0.zip'
     response = requests.get(url)
@@ -2,18 +2,32 @@ import click
 from .. import __package__ as package_name
 from ._utils import (
     find_appropriate_crs, 
+    get_transformer,
+    geocode,
     download_osm_data, 
-    find_osm_bounds, 
     prepare_osrm_data,
     download_population_density,
-    download_gadm_administrative_data
+    load_feather,
+    remove_digest,
+    select_within_distance,
+    download_gadm_administrative_data,
+    directories_size,
+    list_osm_files,
+    list_route_dirs,
+    osm_base_name,
+    OVERPASS_FILTERS
 )
+from ._bounds_cache import osm_areas, index_file
 from .generator import generate_spatial, generate_temporal
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os
+import shutil
 import shapely as sp
 import platformdirs
 import geopandas as gpd   
 import pandas as pd
+import numpy as np
 from beaupy import select_multiple
 import humanize
 import autopage
@@ -34,109 +48,118 @@ def generate(name):
 @click.option('--name', '-n', type=str, required=False)
 @click.option('--compress', '-c', is_flag=True, default=False)
 @click.option('--force', '-f', is_flag=True, default=False)
-def get_area(city, radius, name, compress, force):
+@click.option('--osm-filter', type=click.Choice(list(OVERPASS_FILTERS)), default='routing', show_default=True, help="OpenStreetMap elements to download")
+def get_area(city, radius, name, compress, force, osm_filter):
     if name is None:
         name = f'{city}-{radius}km'
     data_dir = Path(platformdirs.user_data_dir(package_name))
     data_dir.mkdir(parents=True, exist_ok=True)
-    # Geocode the city
-    res = gpd.tools.geocode(city, provider='nominatim', user_agent=package_name)
-    # The CRS of the result is WGS 84 (EPSG:4326), so we can set it explicitly
-    res.set_crs(epsg=4326, inplace=True)
+    # Geocode the city (the CRS of the result is WGS 84, i.e., EPSG:4326)
+    res = geocode(city, data_dir, user_agent=package_name)
     click.echo(f'Getting area {name} centered at {res.iloc[0].address} ({res.iloc[0].geometry}), with a radius of {radius}km and saving into {data_dir}')
 
     # Find an appropriate CRS for the UTM zone
     crs = find_appropriate_crs(res.iloc[0].geometry.y, res.iloc[0].geometry.x)
     # Create a GeoDataFrame with the bounding box, with the appropriate CRS
-    bbox = res.to_crs(crs).buffer(radius * 1000)
-    bounds = sp.box(*bbox.to_crs(epsg=4326).total_bounds)
+    center = sp.Point(get_transformer(res.crs, crs).transform(res.iloc[0].geometry.x, res.iloc[0].geometry.y))
+    bbox = gpd.GeoSeries([center.buffer(radius * 1000)], crs=crs)
+    bbox_bounds = bbox.to_crs(epsg=4326).total_bounds
+    bounds = sp.box(*bbox_bounds)
     if not force:
         click.echo(f'Checking if the data is already downloaded')
-        for file in data_dir.iterdir():
-            if '.osm' not in file.suffixes:
-                continue
-            file_bbox = find_osm_bounds(file)
-            if file_bbox.contains(bounds):
+        for file, _, file_bbox in osm_areas(data_dir):
+            if file_bbox is not None and file_bbox.contains(bounds):
                 click.echo(f'OpenMap data already available in {file}, skipping download')
                 return
     click.echo(f'Downloading data from OpenMap for {name}')
-    download_osm_data(*bbox.to_crs(epsg=4326).total_bounds, output_filename=data_dir / f'{name}.osm', bzip=compress)
+    output_filename = download_osm_data(*bbox_bounds, output_filename=data_dir / f'{name}.osm', bzip=compress, osm_filter=osm_filter)
+    # the digest has just been computed, the file is indexed right away so that it is not verified again
+    index_file(data_dir, output_filename)
 
     click.echo(f'OpenMap data downloaded successfully in {data_dir}')
 
 @cli.command()
 def list_areas():
     data_dir = Path(platformdirs.user_data_dir(package_name))
-    files = [d for d in data_dir.iterdir() if '.osm' in d.suffixes]
-    if not files:
+    areas = osm_areas(data_dir)
+    if not areas:
         click.echo('No OpenMap data available')
         return
 
     with autopage.AutoPager() as out:
-        for d in files:
-            out.write(f"{d.name} ({humanize.naturalsize(d.stat().st_size, binary=True)}) {find_osm_bounds(d).bounds}\n")
+        for d, stat, bbox in areas:
+            out.write(f"{d.name} ({humanize.naturalsize(stat.st_size, binary=True)}) {bbox.bounds if bbox is not None else None}\n")
 
 @cli.command()
 def delete_areas():
     data_dir = Path(platformdirs.user_data_dir(package_name))
-    files = [d for d in data_dir.iterdir() if '.osm' in d.suffixes]
+    files = list_osm_files(data_dir)
     if not files:
         click.echo('No OpenMap data to delete')
         return
-    selected = select_multiple([f'{d.name} ({humanize.naturalsize(d.stat().st_size, binary=True)})' for d in files], return_indices=True, pagination=True)
+    selected = select_multiple([f'{d.name} ({humanize.naturalsize(stat.st_size, binary=True)})' for d, stat in files], return_indices=True, pagination=True)
     if selected:
         click.confirm(f'Are you sure you want to delete {len(selected)} file(s)?', abort=True)
         freed = 0
         for i in selected:
-            click.echo(f'Deleting {files[i]}')
-            freed += files[i].stat().st_size
-            files[i].unlink()
+            file, stat = files[i]
+            click.echo(f'Deleting {file}')
+            freed += stat.st_size
+            file.unlink()
+            remove_digest(file)
         click.echo(f'Freed {humanize.naturalsize(freed, binary=True)}')
 
 @cli.command()
 def create_routes():
     data_dir = Path(platformdirs.user_data_dir(package_name))
-    files = [d for d in data_dir.iterdir() if '.osm' in d.suffixes]
+    files = list_osm_files(data_dir)
     if not files:
         click.echo('No OpenMap data to process')
         return
-    selected = select_multiple([f'{d.name} ({humanize.naturalsize(d.stat().st_size, binary=True)})' for d in files], return_indices=True, pagination=True)
+    selected = select_multiple([f'{d.name} ({humanize.naturalsize(stat.st_size, binary=True)})' for d, stat in files], return_indices=True, pagination=True)
+    files = [d for d, _ in files]
     if selected:
         click.confirm(f'Are you sure you want to process {len(selected)} file(s)?', default=True, abort=True)
-        for i in selected:
-            click.echo(f'Processing {files[i].name}')
-            prepare_osrm_data(files[i])
+        # OSRM processes are multi-threaded themselves, so each file gets a share of the cores
+        cpu_count = os.cpu_count() or 1
+        workers = max(1, min(len(selected), cpu_count // 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for i in selected:
+                click.echo(f'Processing {files[i].name}')
+                futures.append(executor.submit(prepare_osrm_data, files[i], threads=max(1, cpu_count // workers)))
+            for future in futures:
+                future.result()
         click.echo(f'Processed {len(selected)} file(s)')
 
 @cli.command()
 def list_routes():
     data_dir = Path(platformdirs.user_data_dir(package_name))
-    files = [d for d in data_dir.iterdir() if d.name.endswith('-routes')]
+    files = list_route_dirs(data_dir)
     if not files:
         click.echo('No OpenMap routes available')
         return
 
     with autopage.AutoPager() as out:
-        for d in files:
-            out.write(f"{d.name} ({humanize.naturalsize(sum(f.stat().st_size for f in d.iterdir()), binary=True)})")
+        for d, size in zip(files, directories_size(files)):
+            out.write(f"{d.name} ({humanize.naturalsize(size, binary=True)})\n")
 
 @cli.command()
 def delete_routes():
     data_dir = Path(platformdirs.user_data_dir(package_name))
-    files = [d for d in data_dir.iterdir() if d.name.endswith('-routes')]
+    files = list_route_dirs(data_dir)
     if not files:
         click.echo('No OpenMap routes to delete')
         return
-    selected = select_multiple([f'{d.name} ({humanize.naturalsize(sum(f.stat().st_size for f in d.iterdir()), binary=True)})' for d in files], return_indices=True, pagination=True)
+    sizes = directories_size(files)
+    selected = select_multiple([f'{d.name} ({humanize.naturalsize(size, binary=True)})' for d, size in zip(files, sizes)], return_indices=True, pagination=True)
     if selected:
         click.confirm(f'Are you sure you want to delete {len(selected)} directory(ies)?', abort=True)
         freed = 0
         for i in selected:
             click.echo(f'Deleting {files[i]}')
-            freed += sum(f.stat().st_size for f in files[i].iterdir())
-            for f in files[i].iterdir():
-                f.unlink()
-            files[i].rmdir()
+            freed += sizes[i]
+            shutil.rmtree(files[i])
         click.echo(f'Freed {humanize.naturalsize(freed, binary=True)}')
 
 @cli.command()
@@ -195,47 +218,37 @@ def delete_administrative_data(level):
 @click.option('--no-intersect-administrative', '-n', is_flag=True, default=False)
 def generate_instance(city, radius, patients, departing_points, no_intersect_administrative):
     data_dir = Path(platformdirs.user_data_dir(package_name))
-    # Geocode the city
-    res = gpd.tools.geocode(city, provider='nominatim', user_agent=package_name)
-    # The CRS of the result is WGS 84 (EPSG:4326), so we can set it explicitly
-    res.set_crs(epsg=4326, inplace=True)
+    # Geocode the city (the CRS of the result is WGS 84, i.e., EPSG:4326)
+    res = geocode(city, data_dir, user_agent=package_name)
     click.echo(f'Area {city} centered at {res.iloc[0].address} ({res.iloc[0].geometry}), with a radius of {radius}km')
 
     # Find an appropriate CRS for the UTM zone
     crs = find_appropriate_crs(res.iloc[0].geometry.y, res.iloc[0].geometry.x)
     # Create a GeoDataFrame with the bounding box, with the appropriate CRS
-    bbox = res.to_crs(crs).buffer(radius * 1000)
+    center = sp.Point(get_transformer(res.crs, crs).transform(res.iloc[0].geometry.x, res.iloc[0].geometry.y))
+    bbox = gpd.GeoSeries([center.buffer(radius * 1000)], crs=crs)
     bounds = sp.box(*bbox.to_crs(epsg=4326).total_bounds)
 
     # search for the openmap data file that contains the area
     openmap_file = None
-    for file in data_dir.iterdir():
-        if '.osm' not in file.suffixes:
-            continue
-        file_bbox = find_osm_bounds(file)
-        if file_bbox.contains(bounds):
+    for file, _, file_bbox in osm_areas(data_dir):
+        if file_bbox is not None and file_bbox.contains(bounds):
             openmap_file = file
             break
     if openmap_file is None:
         click.echo(f'No OpenMap data available for {city}')
         click.prompt('Would you like to download it now?', type=bool, default=True)
-        get_area(city, radius, None, False, False)
+        get_area(city, radius, None, False, False, 'routing')
         openmap_file = data_dir / f'{city}-{radius}km.osm.bz2'
     click.echo(f'OpenMap data available in {openmap_file}')
     
     # Search for the routes data
-    routes_dir = None
-    ref_file_name = ".".join(openmap_file.name.split('.')[:-2])
-    for file in data_dir.iterdir():        
-        if file.is_dir() and (file.name.startswith(ref_file_name)) and file.name.endswith('-routes'):
-            routes_dir = file
-            break
-
-    if routes_dir is None:
+    ref_file_name = osm_base_name(openmap_file.name)
+    routes_dir = data_dir / f'{ref_file_name}-routes'
+    if not routes_dir.is_dir():
         click.echo('No routes data available for this area')
         click.prompt('Would you like to process it now?', type=bool, default=True)
         prepare_osrm_data(openmap_file)
-        routes_dir = data_dir / f'{ref_file_name}-routes'
     routes_file = routes_dir / (ref_file_name + '.osrm')
     click.echo(f'Routes data available in {routes_dir}')
     router = pyosrm.PyOSRM(str(routes_file), algorithm='MLD')
@@ -245,7 +258,10 @@ def generate_instance(city, radius, patients, departing_points, no_intersect_adm
         click.echo('No population density data available')
         click.prompt('Would you like to download it now?', type=bool, default=True)
         download_population_density(population_density_file)  
-    population_density = gpd.read_feather(population_density_file)
+    population_density = load_feather(population_density_file)
+    # restrict the (EU-wide) dataset to the area of interest before any reprojection
+    west, south, east, north = bbox.to_crs(population_density.crs).total_bounds
+    population_density = population_density.cx[west:east, south:north]
     
     # search for the closest administrative unit
     if not no_intersect_administrative:
@@ -254,18 +270,23 @@ def generate_instance(city, radius, patients, departing_points, no_intersect_adm
             click.echo('No administrative data available')
             click.prompt('Would you like to download it now?', type=bool, default=True)
             get_administrative_data(2)
-        administrative_data = gpd.read_feather(administrative_data_file)
-        administrative_data = administrative_data.to_crs(res.crs)
-        administrative_data = administrative_data[administrative_data.contains(res.iloc[0].geometry)]  
+        # only the geometries of the administrative units are needed
+        administrative_data = load_feather(administrative_data_file, columns=['geometry'])
+        # the city location is projected onto the administrative data (rather than the other way round), so that
+        # the spatial index of the (cached) data can be reused and the exact test runs only on the few
+        # administrative units whose bounding box contains the city
+        city_location = res.to_crs(administrative_data.crs).iloc[0].geometry
+        administrative_data = administrative_data.iloc[administrative_data.sindex.query(city_location)]
+        administrative_data = administrative_data[administrative_data.contains(city_location)]
         assert administrative_data.shape[0] == 1, 'The city should be contained in a single administrative unit'       
         population_density = population_density.to_crs(administrative_data.crs)
-        population_density = population_density[population_density.geometry.intersects(administrative_data.iloc[0].geometry)]
+        # the spatial index prunes the candidates before the exact intersection test
+        population_density = population_density.iloc[np.sort(population_density.sindex.query(administrative_data.iloc[0].geometry, predicate='intersects'))]
    
     # Make the datasets compatible w.r.t. crs
-    population_density.to_crs(crs, inplace=True)
-    res.to_crs(crs, inplace=True)
+    population_density = population_density.to_crs(crs)
     # Select the population density within the radius
-    population_density = population_density[population_density.geometry.distance(res.iloc[0].geometry) < radius * 1000]
+    population_density = select_within_distance(population_density, center, radius * 1000)
     # Generate the instance
     click.echo('Generating instance')       
     spatial_data = generate_spatial(patients + departing_points, population_density, router)
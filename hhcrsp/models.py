@@ -1,10 +1,22 @@
 from typing import Optional, Literal, Annotated, Any
-from pydantic import BaseModel, Field, model_validator, computed_field, AliasChoices
+from pydantic import BaseModel, Field, model_validator, field_validator, computed_field, AliasChoices, ValidationInfo
+from pydantic import ConfigDict, BeforeValidator, PlainSerializer, WithJsonSchema, Discriminator, Tag
 from collections.abc import Sequence
 import hashlib
+import functools
+import os
 import click
 import numpy as np
 import math
+import itertools
+from ._kernels import off_diagonal_stats
+
+# instances coming from an already verified source (e.g., a cache of instances dumped by the toolbox) can skip the
+# cross reference checks by default, by setting the HHCRSP_SKIP_VALIDATION environment variable: field validation,
+# the structural checks and the references needed to build the indexes (the required services and the departing
+# points of the caregivers) are still checked, while the other inconsistencies (e.g., unknown abilities, services 
+# of the same type, incompatibilities) would pass unnoticed
+SKIP_VALIDATION = os.environ.get('HHCRSP_SKIP_VALIDATION', '').lower() not in ('', '0', 'false', 'no')
 
 class DepartingPoint(BaseModel):
     id: Annotated[str, Field(min_length=1, frozen=True)]
@@ -14,14 +26,16 @@ class DepartingPoint(BaseModel):
 class Caregiver(BaseModel):
     id: Annotated[str, Field(min_length=1, frozen=True)]
     abilities: Annotated[list[str], Field(min_length=1)]
-    departing_point: Annotated[str, Field(min_length=1, alias=AliasChoices('starting_point_id', 'departing_point'))]
+    departing_point: Annotated[str, Field(min_length=1, validation_alias=AliasChoices('starting_point_id', 'departing_point'))]
     # FIXME: working shift (in the generator) should be already mapped to the suitable type list(map(int, self.working_shift))
     working_shift: tuple[int, int] = None
+    _abilities: Annotated[frozenset[str], Field(exclude=True, repr=False)] = None
 
     @model_validator(mode='after')
     def _check_validity(self) -> 'Caregiver':
         if self.working_shift is not None:
             assert self.working_shift[0] < self.working_shift[1], f"Working shift not correct {self.working_shift}"
+        self._abilities = frozenset(self.abilities)
         return self
 
 class Synchronization(BaseModel):
@@ -44,16 +58,25 @@ class RequiredService(BaseModel):
     service: Annotated[str, Field(min_length=1)]
     duration: Optional[Annotated[int, Field(gt=0)]] = None
     _actual_duration: Annotated[int, Field(gt=0, exclude=True, repr=False)] = None
+    _compatible_caregivers: Annotated[int, Field(ge=0, exclude=True, repr=False)] = None
 
 class Patient(BaseModel):
     id: Annotated[str, Field(min_length=1, frozen=False)]
     required_services: Annotated[list[RequiredService], 
-                                 Field(min_length=1, max_length=2, alias=AliasChoices('required_caregivers', 'required_services'))]
+                                 Field(min_length=1, max_length=2, validation_alias=AliasChoices('required_caregivers', 'required_services'))]
     distance_matrix_index: Optional[Annotated[int, Field(ge=0)]] = None
     time_window: Optional[tuple[int, int]]
     location: Optional[tuple[float, float]] = None
     synchronization: Optional[Synchronization] = None
-    incompatible_caregivers: set[str] = None
+    # the incompatible caregivers are dumped sorted, so that the dumps (and the signature) do not depend on the set ordering
+    incompatible_caregivers: Annotated[frozenset[str], PlainSerializer(sorted, return_type=list[str])] = frozenset()
+    _required_service_ids: Annotated[frozenset[str], Field(exclude=True, repr=False)] = None
+    _required_services_by_id: Annotated[dict[str, RequiredService], Field(exclude=True, repr=False)] = None
+
+    @field_validator('incompatible_caregivers', mode='before')
+    @classmethod
+    def _no_incompatible_caregivers(cls, value):
+        return frozenset() if value is None else value
 
     @model_validator(mode='after')
     def _validity_checks(self) -> 'Patient':
@@ -61,14 +84,72 @@ class Patient(BaseModel):
             assert self.synchronization is not None, "Synchronization specification is mandatory if more than one caregiver is  required"
         if self.time_window is not None:
             assert self.time_window[0] < self.time_window[1], f"Time window not correct {self.time_window}"
+        self._required_services_by_id = {}
+        for s in self.required_services:
+            self._required_services_by_id.setdefault(s.service, s)
+        self._required_service_ids = frozenset(self._required_services_by_id)
         return self
     
+def _distance_matrix(value : Any) -> np.ndarray:
+    # the distance matrix is stored as a contiguous int32 numpy array
+    if isinstance(value, np.ndarray) and value.dtype == np.int32 and value.flags.c_contiguous:
+        return value
+    try:
+        matrix = np.asarray(value)
+    except ValueError:
+        matrix = None
+    if matrix is None or matrix.ndim != 2:
+        # look for the wrong row, for reporting
+        if isinstance(value, Sequence) and all(isinstance(r, Sequence) for r in value):
+            for i, r in enumerate(value):
+                if len(r) != len(value[0]):
+                    raise ValueError(f"Row {i} of the distance matrix has {len(r)} columns, while row 0 has {len(value[0])}")
+        raise ValueError("The distances should be a matrix")
+    if matrix.dtype.kind == 'f':
+        if not (np.isfinite(matrix).all() and np.array_equal(matrix, np.trunc(matrix))):
+            raise ValueError("The distances should be integer numbers")
+    elif matrix.dtype.kind not in 'iu':
+        raise ValueError("The distances should be integer numbers")
+    limits = np.iinfo(np.int32)
+    if matrix.size and (matrix.min() < limits.min or matrix.max() > limits.max):
+        raise ValueError(f"The distances should be in the range [{limits.min}, {limits.max}]")
+    return np.ascontiguousarray(matrix, dtype=np.int32)
+
+DistanceMatrix = Annotated[np.ndarray, 
+                           BeforeValidator(_distance_matrix), 
+                           PlainSerializer(lambda matrix: matrix.tolist(), return_type=list[list[int]]),
+                           WithJsonSchema({ 'type': 'array', 'items': { 'type': 'array', 'items': { 'type': 'integer' } } })]
+
+@functools.cache
+def _field_names(model : type[BaseModel]) -> dict[str, str]:
+    # mapping from the accepted input names (including the validation aliases) to the field names
+    names = { name: name for name in model.model_fields }
+    for name, field in model.model_fields.items():
+        if isinstance(field.validation_alias, AliasChoices):
+            names.update((alias, name) for alias in field.validation_alias.choices)
+    return names
+
+def _construct(model : type[BaseModel], data : dict[str, Any], **converters) -> BaseModel:
+    # build a model from trusted data without validation, the converters map the values of the given fields
+    # (e.g., building the nested models), unknown names (e.g., computed fields) are ignored
+    names = _field_names(model)
+    values = {}
+    for key, value in data.items():
+        name = names.get(key)
+        if name is None:
+            continue
+        if value is not None and name in converters:
+            value = converters[name](value)
+        values[name] = value
+    return model.model_construct(**values)
+
 class Instance(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
     name: Annotated[str, Field(min_length=1, frozen=False)]
     # FIXME: round area bounds outside the function tuple(np.around(area, decimals=4))
     area: Optional[Sequence[float]] = None
     # FIXME: (in the geenrator) compute times outside the function [[int(d.total_seconds() // 60) for d in r] for r in distances]
-    distances: Sequence[Sequence[int]]
+    distances: DistanceMatrix
     departing_points : Sequence[DepartingPoint]
     caregivers : Sequence[Caregiver]
     patients : Sequence[Patient]
@@ -77,14 +158,37 @@ class Instance(BaseModel):
     _caregivers: Annotated[dict[str, Caregiver], Field(exclude=True, repr=False)] = None
     _patients: Annotated[dict[str, Patient], Field(exclude=True, repr=False)] = None
     _services: Annotated[dict[str, Service], Field(exclude=True, repr=False)] = None
+    _service_caregivers: Annotated[dict[str, frozenset[str]], Field(exclude=True, repr=False)] = None
+    _required_services_count: Annotated[int, Field(exclude=True, repr=False)] = None
+    _patient_positions: Annotated[dict[str, int], Field(exclude=True, repr=False)] = None
+    _patients_matrix_index: Annotated[np.ndarray, Field(exclude=True, repr=False)] = None
+    _time_windows: Annotated[np.ndarray, Field(exclude=True, repr=False)] = None
+
+    def __eq__(self, other : Any) -> bool:
+        # the distance matrix is an array, hence it is compared by value (the other fields are compared as pydantic does,
+        # the private attributes are only derived from the fields)
+        if type(self) is not type(other):
+            return NotImplemented
+        return all(np.array_equal(self.distances, other.distances) if f == 'distances' else getattr(self, f) == getattr(other, f) 
+                   for f in type(self).model_fields)
 
     @model_validator(mode='after')
-    def _check_validity(self) -> 'Instance':
+    def _check_validity(self, info : ValidationInfo) -> 'Instance':
+        self._check_structure()
+        # the cross references can be left unchecked for trusted data, validating them with
+        # the context { 'check_cross_references': False } (or setting HHCRSP_SKIP_VALIDATION)
+        context = info.context or {}
+        if context.get('check_cross_references', not SKIP_VALIDATION):
+            self.check_cross_references()
+        else:
+            self._build_indexes()
+        return self
+
+    def _check_structure(self):
         # Matrix Size
         expected_matrix_size = len(self.departing_points) + len(self.patients)
-        assert len(self.distances) == expected_matrix_size, f"The distance matrix is supposed to have {expected_matrix_size} rows ({len(self.departing_points)} departing points + {len(self.patients)} patients)"
-        for i, r in enumerate(self.distances):
-            assert(len(r)) == expected_matrix_size, f"Row {i} of the distance matrix is supposed to have {expected_matrix_size} columns ({len(self.departing_points)} departing points + {len(self.patients)} patients)"
+        assert self.distances.shape[0] == expected_matrix_size, f"The distance matrix is supposed to have {expected_matrix_size} rows ({len(self.departing_points)} departing points + {len(self.patients)} patients)"
+        assert self.distances.shape[1] == expected_matrix_size, f"The rows of the distance matrix are supposed to have {expected_matrix_size} columns ({len(self.departing_points)} departing points + {len(self.patients)} patients)"
         # check departing point indexes (i.e., old versions of the generator might not have them)
         for i, dp in enumerate(self.departing_points):
             if dp.distance_matrix_index is None:
@@ -93,111 +197,199 @@ class Instance(BaseModel):
         for i, p in enumerate(self.patients):
             if p.distance_matrix_index is None:
                 p.distance_matrix_index = i + len(self.departing_points)
+        # the matrix indexes should be a permutation of the rows of the distance matrix
+        matrix_indexes = np.fromiter((l.distance_matrix_index for l in itertools.chain(self.departing_points, self.patients)), 
+                                     dtype=np.int64, count=expected_matrix_size)
+        if not np.array_equal(np.sort(matrix_indexes), np.arange(expected_matrix_size)):
+            # look for the first repeated index, for reporting
+            seen_indexes = set()
+            for l in itertools.chain(self.departing_points, self.patients):
+                assert l.distance_matrix_index not in seen_indexes, f"Matrix index of {'departing point' if isinstance(l, DepartingPoint) else 'patient'} {l.id} is already present as a matrix index"
+                seen_indexes.add(l.distance_matrix_index)
+            assert False, f"Some patients / departing point have been wrongly assigned their matrix index"
+        # checking that the time window is compatible with the service time distance in case of sequential services
+        for p in self.patients:
+            for s in p.required_services:
+                if p.synchronization and p.synchronization.type == 'sequential':
+                    assert p.time_window[1] - p.time_window[0] >= min(p.synchronization.distance), f"Patient {p.id} has a time window too short for the synchronization services required"
+
+    def check_cross_references(self):
+        # checks the consistency of the references among the components of the instance, filling in the derived data
         # Foreign keys (caregivers to services and departing points)
-        services_id = set(s.id for s in self.services)
-        services = { s.id: s for s in self.services }
+        services_id = frozenset(s.id for s in self.services)
         caregivers_service_coverage = set()
-        matrix_indexes = set()
-        departing_points = set(dp.id for dp in self.departing_points)
+        departing_points = frozenset(dp.id for dp in self.departing_points)
         for c in self.caregivers:
-            provided_services = set(c.abilities)
-            assert provided_services <= set(services_id), f"Abilities of caregiver {c.id} ({provided_services - set(services_id)}) are not included in services"
+            provided_services = c._abilities
+            assert provided_services <= services_id, f"Abilities of caregiver {c.id} ({provided_services - services_id}) are not included in services"
             caregivers_service_coverage |= provided_services
             assert c.departing_point in departing_points, f"Departing point {c.departing_point} of caregiver {c.id} is not present in the list of departing points"
-        for d in self.departing_points:
-            assert d.distance_matrix_index not in matrix_indexes, f"Matrix index of departing point {d.id} is already present as a matrix index"
-            matrix_indexes.add(d.distance_matrix_index)
-        # Foreign keys (patients to required services), also setting 
+        # Foreign keys (patients to required services)
         patients_service_requirement = set()
         for p in self.patients:
-            required_services = set(s.service for s in p.required_services)
-            assert required_services <= set(services_id), f"Services required by patient {p.id} ({required_services - set(services_id)}) are not included in services"
+            required_services = p._required_service_ids
+            assert required_services <= services_id, f"Services required by patient {p.id} ({required_services - services_id}) are not included in services"
             patients_service_requirement |= required_services
-            assert p.distance_matrix_index not in matrix_indexes, f"Matrix index of patient {p.id} is already present as a matrix index"
-            matrix_indexes.add(p.distance_matrix_index)        
-            # setting default durations if not given
-            for s in p.required_services:
-                s._actual_duration = s.duration or services[s.service].default_duration                
-            service_types = set(services[rs].type for rs in required_services)
-            assert len(service_types) == len(required_services), f"Patient {p.id} is requiring services {required_services} of the same types {service_types}"
+        # the foreign keys are consistent, so the dictionaries and derived data can be filled in
+        self._build_indexes()
+        for p in self.patients:
+            required_services = p._required_service_ids
+            service_types = set()
+            for rs in required_services:
+                service_type = self._services[rs].type
+                assert service_type not in service_types, f"Patient {p.id} is requiring services {required_services} of the same type {service_type}"
+                service_types.add(service_type)
             # Checking incompatible caregivers and getting rid of those which are not providing the required services
             if p.incompatible_caregivers:
-                possible_caregivers = set(c.id for c in self.caregivers if set(c.abilities) & required_services)
+                possible_caregivers = frozenset().union(*(self._service_caregivers[rs] for rs in required_services))
                 # get rid of non meaningful caregivers
-                if p.incompatible_caregivers & possible_caregivers != p.incompatible_caregivers:
+                if not p.incompatible_caregivers.issubset(possible_caregivers):
                     click.secho(f'Patient {p.id} has a set of incompatible caregivers which includes also caregivers not directly involved with the required services, normalizing it', fg='yellow', err=True)
                     p.incompatible_caregivers = p.incompatible_caregivers & possible_caregivers
                 for s in p.required_services:
-                    possible_caregivers_for_service = set(c.id for c in self.caregivers if s.service in c.abilities and c.id not in p.incompatible_caregivers)
-                    assert possible_caregivers_for_service, f"Patient {p.id} has no compatible caregiver for service {s.id} (possibly because of incompatibilities or the no caregiver exists for the service)"
+                    assert s._compatible_caregivers > 0, f"Patient {p.id} has no compatible caregiver for service {s.service} (possibly because of incompatibilities or the no caregiver exists for the service)"
                 
         assert patients_service_requirement <= caregivers_service_coverage, f"Some services required by patients are not provided by any caregiver ({patients_service_requirement - caregivers_service_coverage})"        
-        assert matrix_indexes == set(range(expected_matrix_size)), f"Some patients / departing point have been wrongly assigned their matrix index"
-        # checking that the time window is compatible with the service time distance in case of sequential services
-        for p in self.patients:
-            for s in p.required_services:
-                if p.synchronization and p.synchronization.type == 'sequential':
-                    assert p.time_window[1] - p.time_window[0] >= min(p.synchronization.distance), f"Patient {p.id} has a time window too short for the synchronization services required"
-        
+
+    def _build_indexes(self):
         # fill in the dictionaries for quicker access
         self._departing_points = { dp.id: dp for dp in self.departing_points }
         self._caregivers = { c.id: c for c in self.caregivers }
         self._patients = { p.id: p for p in self.patients }        
         self._services = { s.id: s for s in self.services }
-       
-        return self
+        # the references used by the derived data are checked also when the cross references are not (the
+        # errors are raised as ValueError, so that they are reported by pydantic as validation errors)
+        for c in self.caregivers:
+            if c.departing_point not in self._departing_points:
+                raise ValueError(f"Departing point {c.departing_point} of caregiver {c.id} is not present in the list of departing points")
+        for p in self.patients:
+            for s in p.required_services:
+                if s.service not in self._services:
+                    raise ValueError(f"Service {s.service} required by patient {p.id} is not included in services")
+        # index of the caregivers able to provide each service
+        self._service_caregivers = { s.id: frozenset(c.id for c in self.caregivers if s.id in c._abilities) for s in self.services }
+        # setting default durations if not given and counting the caregivers compatible with each required service
+        for p in self.patients:
+            for s in p.required_services:
+                s._actual_duration = s.duration or self._services[s.service].default_duration
+                s._compatible_caregivers = len(self._service_caregivers[s.service] - p.incompatible_caregivers)
+        # the total number of services to provide (i.e., the load to balance among the caregivers)
+        self._required_services_count = sum(len(p.required_services) for p in self.patients)
+        # the positions of the patients and their matrix indexes, for the array based computations (the time windows
+        # are packed on first use, since they are optional and only needed by the features and the costs)
+        self._patient_positions = { p.id: i for i, p in enumerate(self.patients) }
+        self._patients_matrix_index = np.fromiter((p.distance_matrix_index for p in self.patients), dtype=np.int64, count=len(self.patients))
+        self._time_windows = None
+
+    def _patients_time_windows(self) -> np.ndarray:
+        # the time windows of the patients as a patients x 2 int32 array
+        if self._time_windows is None:
+            for p in self.patients:
+                if p.time_window is None:
+                    raise ValueError(f"Patient {p.id} has no time window")
+            time_windows = np.array([p.time_window for p in self.patients], dtype=np.int64).reshape(-1, 2)
+            limits = np.iinfo(np.int32)
+            if time_windows.size and (time_windows.min() < limits.min or time_windows.max() > limits.max):
+                raise ValueError(f"The time windows should be in the range [{limits.min}, {limits.max}]")
+            self._time_windows = time_windows.astype(np.int32)
+        return self._time_windows
+
+    @classmethod
+    def from_trusted(cls, data : dict[str, Any], check : bool=False) -> 'Instance':
+        # fast path for data coming from a trusted source (e.g., dumped by the toolbox itself): the field validation
+        # is skipped and only the derived data are computed, the consistency checks are performed only if requested
+        instance = _construct(cls, data, 
+                              distances=_distance_matrix,
+                              departing_points=lambda v: [_construct(DepartingPoint, dp, location=tuple) for dp in v],
+                              caregivers=lambda v: [_construct(Caregiver, c, working_shift=tuple)._check_validity() for c in v],
+                              patients=lambda v: [_construct(Patient, p | { 'incompatible_caregivers': p.get('incompatible_caregivers') or () }, 
+                                                             required_services=lambda v: [_construct(RequiredService, s) for s in v],
+                                                             time_window=tuple, location=tuple, incompatible_caregivers=frozenset,
+                                                             synchronization=lambda v: _construct(Synchronization, v, distance=tuple))._validity_checks() for p in v],
+                              services=lambda v: [_construct(Service, s) for s in v])
+        if check:
+            instance._check_structure()
+            instance.check_cross_references()
+        else:
+            instance._build_indexes()
+        return instance
     
+    def invalidate_caches(self):
+        # the signature and the features are computed once, this method should be called if the instance is modified
+        for name in ('signature', 'features'):
+            self.__dict__.pop(name, None)
+
+    def model_copy(self, *, update : Optional[dict[str, Any]] = None, deep : bool = False) -> 'Instance':
+        # the cached values and the derived data are copied along with the fields, hence when the copy is updated the
+        # former are dropped and the latter are rebuilt (on copies of the patients, which hold part of them)
+        copy = super().model_copy(update=update, deep=deep)
+        if update:
+            copy.invalidate_caches()
+            if not deep:
+                copy.patients = [p.model_copy(deep=True) for p in copy.patients]
+            copy._build_indexes()
+        return copy
+
     @computed_field
-    @property
+    @functools.cached_property
     def signature(self) -> str:
-        res = b''
-        for f in self.model_fields:
-            res += bytes(f"{getattr(self, f)}", 'utf-8')
-        return hashlib.sha256(res).hexdigest()
+        # the instance is not supposed to change after validation, so the signature is computed once,
+        # the distance matrix is hashed through its binary representation and the other fields through
+        # their (canonical) json dump (the signature identifies the instances, so this format should be kept)
+        h = hashlib.sha256()
+        for f in type(self).model_fields:
+            if f == 'distances':
+                h.update(self.distances.astype('<i4', copy=False).tobytes())
+            else:
+                h.update(self.model_dump_json(include={ f }).encode('utf-8'))
+        return h.hexdigest()
     
-    @property
+    @functools.cached_property
     def features(self) -> dict[str, Any]:
+        # a single pass over the patients collects the counts, the per-service data are computed with the indexes
+        single, double = 0, 0
+        synchronizations = { 'simultaneous': 0, 'sequential': 0 }
+        for p in self.patients:
+            if len(p.required_services) == 1:
+                single += 1
+            elif len(p.required_services) == 2:
+                double += 1
+            if p.synchronization is not None:
+                synchronizations[p.synchronization.type] += 1
+        required_services = [s for p in self.patients for s in p.required_services]
+        compatible_caregivers = np.fromiter((s._compatible_caregivers for s in required_services), dtype=np.int64, count=len(required_services))
+        service_length = np.fromiter((s._actual_duration for s in required_services), dtype=np.int64, count=len(required_services))
         features = {}
         features['patients'] = { 
             'total': len(self.patients), 
-            'single': sum(len(p.required_services) == 1 for p in self.patients) / len(self.patients), 
-            'double': sum(len(p.required_services) == 2 for p in self.patients) / len(self.patients), 
-            'simultaneous': sum(p.synchronization is not None and p.synchronization.type == 'simultaneous' for p in self.patients), 
-            'sequential': sum(p.synchronization is not None and p.synchronization.type == 'sequential' for p in self.patients) 
+            'single': single / len(self.patients), 
+            'double': double / len(self.patients), 
+            'simultaneous': synchronizations['simultaneous'], 
+            'sequential': synchronizations['sequential'] 
         }
         features['caregivers'] = len(self.caregivers)
         features['services'] = len(self.services)
-        compatible_caregivers = []
-        time_windows_size = []
-        service_length = []
-        for p in self.patients:
-            for s in p.required_services:
-                possible_caregivers_for_service = set(c.id for c in self.caregivers if s.service in c.abilities and c.id not in (p.incompatible_caregivers or set()))
-                compatible_caregivers.append(len(possible_caregivers_for_service))
-            time_windows_size.append(p.time_window[1] - p.time_window[0])
-            service_length += [s._actual_duration for s in p.required_services]
-        features['compatible_caregivers'] = { 
-            'min': min(compatible_caregivers), 
-            'avg': sum(compatible_caregivers) / len(compatible_caregivers),
-            'max': max(compatible_caregivers) 
-        }
-        features['time_windows_size'] = { 'min': min(time_windows_size), 'avg': sum(time_windows_size) / len(self.patients), 'max': max(time_windows_size) }
-        features['service_length'] = { 'min': min(service_length), 'avg': sum(service_length) / len(service_length), 'max': max(service_length) }
-        distances = np.array(self.distances)
-        mask = np.ones(distances.shape, dtype=bool)
-        np.fill_diagonal(mask, False)
+        features['compatible_caregivers'] = _min_avg_max(compatible_caregivers)
+        time_windows = self._patients_time_windows()
+        features['time_windows_size'] = _min_avg_max(time_windows[:, 1] - time_windows[:, 0])
+        features['service_length'] = _min_avg_max(service_length)
+        distances_min, distances_avg, distances_max = off_diagonal_stats(self.distances)
         features['distances'] = { 
-            'min': float(distances[mask].min()), 
-            'avg': float(distances[mask].mean()), 
-            'max': float(distances[mask].max()) 
+            'min': float(distances_min), 
+            'avg': float(distances_avg), 
+            'max': float(distances_max) 
         }
         return features
     
+def _min_avg_max(values : np.ndarray) -> dict[str, Any]:
+    # minimum, average and maximum of the (integer) values, as python numbers
+    return { 'min': int(values.min()), 'avg': float(values.mean()), 'max': int(values.max()) }
+    
 ### Solution Model
 
 class PatientVisit(BaseModel):
-    start_service_time: Annotated[int | float, Field(ge=0, alias=AliasChoices('start_service_time', 'arrival_time'))]
-    end_service_time: Annotated[int | float, Field(ge=0, alias=AliasChoices('end_service_time', 'departure_time'))]
+    start_service_time: Annotated[int | float, Field(ge=0, validation_alias=AliasChoices('start_service_time', 'arrival_time'))]
+    end_service_time: Annotated[int | float, Field(ge=0, validation_alias=AliasChoices('end_service_time', 'departure_time'))]
     patient: str
     service: str
     arrival_at_patient: Optional[int | float] = None
@@ -217,27 +409,51 @@ class DepotArrival(BaseModel):
     arrival_time: Annotated[int | float, Field(ge=0)]
     depot: str   
 
+def _location_kind(value : Any) -> Optional[str]:
+    # the kind of a location is given by its keys (note that arrival_time is also an alias of the start service time),
+    # anything which is not a depot is validated as a patient visit
+    if isinstance(value, dict):
+        if 'depot' not in value:
+            return 'visit'
+        return 'departure' if 'departing_time' in value else 'arrival'
+    return _LOCATION_KINDS.get(type(value))
+
+_LOCATION_KINDS = { DepotDeparture: 'departure', PatientVisit: 'visit', DepotArrival: 'arrival' }
+_LOCATION_MODELS = { kind: model for model, kind in _LOCATION_KINDS.items() }
+
+Location = Annotated[Annotated[DepotDeparture, Tag('departure')] | Annotated[PatientVisit, Tag('visit')] | Annotated[DepotArrival, Tag('arrival')], 
+                     Discriminator(_location_kind)]
+
+def _trusted_locations(locations : list[dict[str, Any]]) -> list[DepotDeparture | PatientVisit | DepotArrival]:
+    return [_construct(_LOCATION_MODELS[_location_kind(l)], l) for l in locations]
+
 class CaregiverRoute(BaseModel):
     caregiver_id: str
-    locations: list[DepotDeparture | PatientVisit | DepotArrival]
+    locations: list[Location]
     _visits: Annotated[list[PatientVisit], Field(exclude=True, repr=False)] = []
     _full_route: Annotated[bool, Field(exclude=True, repr=False)] = False
+    # data of the instance the route has been bound to
+    _instance: Annotated[Instance, Field(exclude=True, repr=False)] = None
+    _depot_index: Annotated[int, Field(exclude=True, repr=False)] = None
+    _visits_position: Annotated[np.ndarray, Field(exclude=True, repr=False)] = None
+    _visits_matrix_index: Annotated[np.ndarray, Field(exclude=True, repr=False)] = None
+    _route_matrix_index: Annotated[np.ndarray, Field(exclude=True, repr=False)] = None
 
     @model_validator(mode='after')
     def _check_vallidity(self):
         if self.locations:
             self._full_route = False
-            if type(self.locations[0]) == DepotDeparture:
-                assert type(self.locations[-1]) == DepotArrival, "First location is a depot but last location is not"
+            if isinstance(self.locations[0], DepotDeparture):
+                assert isinstance(self.locations[-1], DepotArrival), "First location is a depot but last location is not"
                 self._full_route = True
             if self._full_route:                
                 assert len(self.locations) > 2, f"Caregiver {self.caregiver_id} has a full route with no intermediate location"            
-                self._visits = [self.locations[i] for i in range(1, len(self.locations) - 1)]
+                self._visits = self.locations[1:-1]
             else:
-                self._visits = [l for l in self.locations]
+                self._visits = list(self.locations)
             prev_time = 0 if not self._full_route else self.locations[0].departing_time
             for i, l in enumerate(self._visits):                
-                assert type(l) == PatientVisit, f"Location {l} of caregiver {self.caregiver_id} (at step {i + 1 if self._full_route else i}) is not a patient location"
+                assert isinstance(l, PatientVisit), f"Location {l} of caregiver {self.caregiver_id} (at step {i + 1 if self._full_route else i}) is not a patient location"
                 assert l.start_service_time >= prev_time, f"Start service time of caregiver {self.caregiver_id} (at step {i + 1 if self._full_route else i}) {l.start_service_time} is not consistent with the previous one ({prev_time})"
                 assert l.end_service_time  > l.start_service_time, f"End service time of caregiver {self.caregiver_id} (at step {i + 1 if self._full_route else i}) {l.end_service_time} is not greater than start service time {l.start_service_time}"
                 prev_time = l.end_service_time
@@ -246,6 +462,18 @@ class CaregiverRoute(BaseModel):
 
         return self    
 
+    def bind(self, instance : Instance) -> 'CaregiverRoute':
+        # resolves once the matrix indexes of the depot of the caregiver and of the visited patients 
+        # (and their positions in the instance), which are used by the checks and the costs computation
+        if self._instance is not instance:
+            self._depot_index = instance._departing_points[instance._caregivers[self.caregiver_id].departing_point].distance_matrix_index
+            self._visits_position = np.fromiter((instance._patient_positions[l.patient] for l in self._visits), dtype=np.int64, count=len(self._visits))
+            self._visits_matrix_index = instance._patients_matrix_index[self._visits_position]
+            # the whole route, from and to the depot
+            self._route_matrix_index = np.concatenate(([self._depot_index], self._visits_matrix_index, [self._depot_index]))
+            self._instance = instance
+        return self
+
 class Solution(BaseModel):
     instance: Optional[Annotated[str, Field(min_length=1)]] = None
     routes: list[CaregiverRoute]
@@ -262,17 +490,30 @@ class Solution(BaseModel):
 
         return self
     
+    @classmethod
+    def from_trusted(cls, data : dict[str, Any]) -> 'Solution':
+        # fast path for data coming from a trusted source (e.g., a solver or a local search driver): the field validation
+        # is skipped and only the derived data of the routes are computed
+        return _construct(cls, data, 
+                          routes=lambda v: [_construct(CaregiverRoute, r, locations=_trusted_locations)._check_vallidity() for r in v])._check_validity()
+    
     def check_validity(self, instance : Instance):
-        # check that all patients are visited
-        patients = {l.patient for r in self.routes for l in r._visits} 
-        visited_patients = {p.id for p in instance.patients}
-        assert patients == visited_patients, f"Some patients are not visited ({visited_patients - patients})"
+        # index of the visits to each patient, together with the caregiver performing them
+        patient_visits = {}
+        for r in self.routes:
+            for l in r._visits:
+                patient_visits.setdefault(l.patient, []).append((r.caregiver_id, l))
+        # check that all patients are visited (the key views are compared as sets, without copying them)
+        assert patient_visits.keys() == instance._patients.keys(), f"Some patients are not visited ({instance._patients.keys() - patient_visits.keys()})"
         # check that all services required by each patient are provided
         for p in instance.patients:
             for s in p.required_services:
-                providing_caregivers = {r.caregiver_id for r in self.routes for l in r._visits if l.patient == p.id and l.service == s.service}
+                providing_caregivers = {caregiver_id for caregiver_id, l in patient_visits[p.id] if l.service == s.service}
                 assert len(providing_caregivers) >= 1, f"Patient {p.id} requires service {s.service} which is not provided"
                 assert len(providing_caregivers) == 1, f"Patient {p.id} requires service {s.service} which is provided by more than one caregiver"
+        # resolve the matrix indexes of the routes
+        for r in self.routes:
+            r.bind(instance)
         # normalize routes, by transforming them into full routes
         for r in self.routes:
             c = instance._caregivers[r.caregiver_id]
@@ -280,45 +521,49 @@ class Solution(BaseModel):
                 continue
             # search for the depot which is the first location of the caregiver
             depot = instance._departing_points[c.departing_point]            
-            # search for the patient which is the first location of the caregiver
-            first_patient = instance._patients[r._visits[0].patient]
-            travel_time = instance.distances[depot.distance_matrix_index][first_patient.distance_matrix_index]
+            # travel from the depot to the first patient of the caregiver
+            travel_time = int(instance.distances[r._depot_index, r._visits_matrix_index[0]])
             # compute the latest time the caregiver can depart to arrive at first patient
             depot_departure = r.locations[0].start_service_time - travel_time
             r.locations.insert(0, DepotDeparture(departing_time=depot_departure, depot=depot.id))
             # compute the earliest time the caregiver arrive at the depot after the last patient
-            last_patient = instance._patients[r._visits[-1].patient]
-            travel_time = instance.distances[last_patient.distance_matrix_index][depot.distance_matrix_index]
+            travel_time = int(instance.distances[r._visits_matrix_index[-1], r._depot_index])
             depot_arrival = r._visits[-1].end_service_time + travel_time
             r.locations.append(DepotArrival(arrival_time=depot_arrival, depot=depot.id))
             r._full_route = True
 
         # check that the times are consistent with the distances and normalize the arrival times
         for r in self.routes:
-            for i in range(len(r._visits) - 1):
-                start_index = instance._patients[r._visits[i].patient].distance_matrix_index
-                end_index = instance._patients[r._visits[i + 1].patient].distance_matrix_index
-                travel_time = instance.distances[start_index][end_index]
-                assert r._visits[i + 1].start_service_time >= r._visits[i].end_service_time + travel_time, f"Route of caregiver {r.caregiver_id} is not consistent with the distances ({r.locations[i].end_service_time} + {travel_time} vs {r.locations[i + 1].start_service_time})"
+            # all the legs between consecutive visits are checked at once, the first inconsistent one is reported
+            travel_times = instance.distances[r._visits_matrix_index[:-1], r._visits_matrix_index[1:]]
+            earliest_arrivals = np.array([l.end_service_time for l in r._visits[:-1]]) + travel_times
+            start_times = np.array([l.start_service_time for l in r._visits[1:]])
+            arrivals = np.array([l.arrival_at_patient or 0 for l in r._visits[1:]])
+            arrivals = np.where(arrivals != 0, arrivals, earliest_arrivals)
+            inconsistent = (start_times < earliest_arrivals) | (start_times < arrivals)
+            if inconsistent.any():
+                i = int(inconsistent.argmax())
+                travel_time = int(travel_times[i])
+                assert r._visits[i + 1].start_service_time >= r._visits[i].end_service_time + travel_time, f"Route of caregiver {r.caregiver_id} is not consistent with the distances ({r._visits[i].end_service_time} + {travel_time} vs {r._visits[i + 1].start_service_time})"
+                assert False, f"Route of caregiver {r.caregiver_id} is not consistent with the arrival at patient"
+            for i, travel_time in enumerate(travel_times.tolist()):
                 if not r._visits[i + 1].arrival_at_patient:
                     r._visits[i + 1].arrival_at_patient = r._visits[i].end_service_time + travel_time
-                assert r._visits[i + 1].start_service_time >= r._visits[i + 1].arrival_at_patient, f"Route of caregiver {r.caregiver_id} is not consistent with the arrival at patient"                
             # check the first location (i.e., depot)
             start_index = instance._departing_points[r.locations[0].depot].distance_matrix_index
-            end_index = instance._patients[r.locations[1].patient].distance_matrix_index
-            travel_time = instance.distances[start_index][end_index]
+            travel_time = int(instance.distances[start_index, r._visits_matrix_index[0]])
             assert r.locations[1].start_service_time >= r.locations[0].departing_time + travel_time, f"Route of caregiver {r.caregiver_id} is not consistent with the distances from the depot ({r.locations[0].departing_time} + {travel_time} vs {r.locations[1].start_service_time})"
             if not r.locations[1].arrival_at_patient:
                 r.locations[1].arrival_at_patient = r.locations[0].departing_time + travel_time
             assert r.locations[1].start_service_time >= r.locations[1].arrival_at_patient, f"Route of caregiver {r.caregiver_id} is not consistent with the arrival at patient"
             # check the last location (i.e., depot)
-            start_index = instance._patients[r.locations[-2].patient].distance_matrix_index
             end_index = instance._departing_points[r.locations[-1].depot].distance_matrix_index
-            travel_time = instance.distances[start_index][end_index]
+            travel_time = int(instance.distances[r._visits_matrix_index[-1], end_index])
             assert r.locations[-1].arrival_time >= r.locations[-2].end_service_time + travel_time, f"Route of caregiver {r.caregiver_id} is not consistent with the distances to the depot ({r.locations[-2].end_service_time} + {travel_time} vs {r.locations[-1].arrival_time})"
             # check that the times are consistent with the service duration
             for l in r._visits:
-                s = next(s for s in instance._patients[l.patient].required_services if s.service == l.service)
+                s = instance._patients[l.patient]._required_services_by_id.get(l.service)
+                assert s is not None, f"Route of caregiver {r.caregiver_id} at {l} is providing a service not required by patient {l.patient}"
                 assert l.end_service_time - l.start_service_time >= s._actual_duration, f"Route of caregiver {r.caregiver_id} at {l} is not consistent with the service durations"
             # check that the times are consistent with the working shift
             c = instance._caregivers[r.caregiver_id]
@@ -326,72 +571,67 @@ class Solution(BaseModel):
         # check that for patients requiring sequential and simultaneous services, the services are provided correctly
         for p in instance.patients:            
             if p.synchronization is not None:
-                caregivers = {l.service: l for r in self.routes for l in r._visits if l.patient == p.id}
+                caregivers = {l.service: l for _, l in patient_visits[p.id]}
                 assert len(caregivers) == 2, f"Patient {p.id} requires double service but they are provided by the same caregiver"
+                first_start = caregivers[p.required_services[0].service].start_service_time
+                second_start = caregivers[p.required_services[1].service].start_service_time
                 if p.synchronization.type == 'simultaneous':
-                    assert caregivers[p.required_services[0].service].start_service_time == caregivers[p.required_services[0].service].start_service_time, f"Patient {p.id} requires simultaneous service but they are not provided simultaneously {caregivers[p.required_services[0].service].start_service_time} vs {caregivers[p.required_services[1].service].start_service_time}"
+                    assert first_start == second_start, f"Patient {p.id} requires simultaneous service but they are not provided simultaneously {first_start} vs {second_start}"
                 else:
-                    assert caregivers[p.required_services[0].service].start_service_time + p.synchronization.distance[0] <= caregivers[p.required_services[1].service].start_service_time, f"Patient {p.id} requires sequential service but the order is not respected (second service starting too early {caregivers[p.required_services[0].service].start_service_time} vs {caregivers[p.required_services[1].service].start_service_time} and min distance {p.synchronization.distance[0]})"
-                    assert caregivers[p.required_services[0].service].start_service_time + p.synchronization.distance[1] >= caregivers[p.required_services[1].service].start_service_time, f"Patient {p.id} requires sequential service but the order is not respected (second service starting too late {caregivers[p.required_services[0].service].start_service_time} vs {caregivers[p.required_services[1].service].start_service_time} and max distance {p.synchronization.distance[1]})"
+                    min_distance, max_distance = p.synchronization.distance
+                    assert first_start + min_distance <= second_start, f"Patient {p.id} requires sequential service but the order is not respected (second service starting too early {first_start} vs {second_start} and min distance {min_distance})"
+                    assert first_start + max_distance >= second_start, f"Patient {p.id} requires sequential service but the order is not respected (second service starting too late {first_start} vs {second_start} and max distance {max_distance})"
         # check that a patient is served after his/her time window starts
         for p in instance.patients:
-            for r in self.routes:
-                for l in r._visits:
-                    if l.patient == p.id:
-                        assert l.start_service_time >= p.time_window[0], f"Patient {p.id} is served before his/her time window starts"
+            for _, l in patient_visits[p.id]:
+                assert l.start_service_time >= p.time_window[0], f"Patient {p.id} is served before his/her time window starts"
         # check that all caregivers provide services for whih they are qualified
         for r in self.routes:
+            c = instance._caregivers[r.caregiver_id]
             for l in r._visits:
-                c = instance._caregivers[r.caregiver_id]
-                assert l.service in c.abilities, f"Caregiver {c.id} is providing a service for which he/she is not qualified"        
+                assert l.service in c._abilities, f"Caregiver {c.id} is providing a service for which he/she is not qualified"        
 
 
     def compute_costs(self, instance : Instance) -> float:
-        tardiness = []
-        distance_traveled = 0        
-        waiting_time = []
-        extra_time = []
-        for r in self.routes:
-            c = instance._caregivers[r.caregiver_id]
-            # compute tardiness
-            for l in r._visits:
-                p = instance._patients[l.patient]
-                tardiness.append(max(0, l.start_service_time - p.time_window[1]))
-            # compute distance traveled
-            start_index = instance._departing_points[c.departing_point].distance_matrix_index
-            for i, l in enumerate(r._visits):
-                end_index = instance._patients[l.patient].distance_matrix_index
-                travel_time = instance.distances[start_index][end_index]
-                distance_traveled += travel_time
-                start_index = end_index
-                if l.arrival_at_patient < l.start_service_time:
-                    waiting_time.append(l.start_service_time - l.arrival_at_patient)
-            end_index = instance._departing_points[c.departing_point].distance_matrix_index
-            distance_traveled += instance.distances[start_index][end_index]            
-
-        services_to_provide = sum(len(p.required_services) for p in instance.patients)
-        min_load = math.floor(services_to_provide / len(instance.caregivers))
-        max_load = math.ceil(services_to_provide / len(instance.caregivers))
-        under_load, over_load = 0, 0
+        # the packed data of the routes (bound to the instance), the attributes of each route are read once
+        routes = [r.bind(instance) for r in self.routes]
+        visits = [l for r in routes for l in r._visits]
+        positions = np.concatenate([r._visits_position for r in routes]) if routes else np.empty(0, dtype=np.int64)
+        route_indexes = [r._route_matrix_index for r in routes]
+        # (with no visits the arrays are integer, as the costs of the other times, rather than numpy's default float)
+        start_times = np.array([l.start_service_time for l in visits]) if visits else np.empty(0, dtype=np.int64)
+        arrival_times = np.array([l.arrival_at_patient for l in visits]) if visits else np.empty(0, dtype=np.int64)
+        # compute distance traveled, the legs of all the routes are fetched at once
+        if route_indexes:
+            legs_from = np.concatenate([indexes[:-1] for indexes in route_indexes])
+            legs_to = np.concatenate([indexes[1:] for indexes in route_indexes])
+            distance_traveled = int(instance.distances[legs_from, legs_to].sum())
+        else:
+            distance_traveled = 0
+        # compute tardiness and waiting times (i.e., the positive part of the differences)
+        tardiness = np.maximum(start_times - instance._patients_time_windows()[positions, 1], 0)
+        waiting_time = np.maximum(start_times - arrival_times, 0)
+
+        min_load = math.floor(instance._required_services_count / len(instance.caregivers))
+        max_load = math.ceil(instance._required_services_count / len(instance.caregivers))
+        # a single pass over the routes accumulates the load unbalance and the extra time
+        under_load, over_load, extra_time = 0, 0, 0
         for r in self.routes:
             if len(r.locations) < min_load:
                 under_load += min_load - len(r.locations)
             if len(r.locations) > max_load:
                 over_load += len(r.locations) - max_load
-
-
-        for r in self.routes:
             c = instance._caregivers[r.caregiver_id]
             if c.working_shift is not None and r.locations[-1].arrival_time > c.working_shift[1]:
-                extra_time.append(r.locations[-1].arrival_time - c.working_shift[1])
+                extra_time += r.locations[-1].arrival_time - c.working_shift[1]
 
         return {
-            'total_tardiness': sum(tardiness)if tardiness else 0, 
-            'max_tardiness': max(tardiness) if tardiness else 0,
+            'total_tardiness': tardiness.sum().item(), 
+            'max_tardiness': tardiness.max(initial=0).item(),
             'traveled_distance': distance_traveled,
-            'total_waiting_time': sum(waiting_time) if waiting_time else 0,
-            'max_waiting_time': max(waiting_time) if waiting_time else 0,
-            'total_extra_time': sum(extra_time) if extra_time else 0,
+            'total_waiting_time': waiting_time.sum().item(),
+            'max_waiting_time': waiting_time.max(initial=0).item(),
+            'total_extra_time': extra_time,
             'under_load': under_load,
             'over_load': over_load,
             'balance': under_load + over_load
@@ -1,15 +1,49 @@
 import click
 from ..models import Instance, Solution
 import json
-import pandas as pd
+import math
+import sys
 from pydantic import ValidationError
+try:
+    # orjson is considerably faster than the standard library in dumping the (compact) features
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    _HAS_ORJSON = False
+
+def _pretty_json(value, indent=4, level=0):
+    # the pretty output, as json.dumps(value, indent=4) but with the floats written with three decimals
+    # (without patching the json encoder)
+    if isinstance(value, float) and math.isfinite(value):
+        return f'{value:.3f}'
+    if isinstance(value, dict) and value:
+        items = (f'{json.dumps(str(k))}: {_pretty_json(v, indent, level + 1)}' for k, v in value.items())
+    elif isinstance(value, (list, tuple)) and value:
+        items = (_pretty_json(v, indent, level + 1) for v in value)
+    else:
+        return json.dumps(value)
+    brackets = '{}' if isinstance(value, dict) else '[]'
+    separator = ',\n' + ' ' * (indent * (level + 1))
+    return f"{brackets[0]}\n{' ' * (indent * (level + 1))}{separator.join(items)}\n{' ' * (indent * level)}{brackets[1]}"
+
+def _dump_json(value, pretty=False):
+    # the pretty output is always produced by _pretty_json, while the compact one is produced by orjson (when available)
+    # or by the standard library with the same separators, so that the output does not depend on the installed extras
+    if pretty:
+        print(_pretty_json(value))
+    elif _HAS_ORJSON:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(orjson.dumps(value, option=orjson.OPT_APPEND_NEWLINE))
+        sys.stdout.buffer.flush()
+    else:
+        print(json.dumps(value, separators=(',', ':'), ensure_ascii=False))
 
 @click.group()
 def cli():
     """This is the validator group"""
 
 @cli.command()
-@click.argument('filename', type=click.File())
+@click.argument('filename', type=click.File('rb'))
 def validate_instance(filename):
     try:
         c = Instance.model_validate_json(filename.read())    
@@ -18,24 +52,19 @@ def validate_instance(filename):
         click.secho(f"{e}", fg='red')
 
 @cli.command()
-@click.argument('filename', type=click.File())
+@click.argument('filename', type=click.File('rb'))
 @click.option('--format', type=click.Choice(['json', 'latex']), default='json', help="Output format")
 @click.option('--pretty', is_flag=True, show_default=True, default=False, help="Pretty print the output")
 def instance_features(filename, format, pretty):
     c = Instance.model_validate_json(filename.read())
     if format == 'json':
-        if not pretty:
-            print(json.dumps(c.features))
-        else:
-            class RoundingFloat(float):
-                __repr__ = staticmethod(lambda x: f'{x:.3f}')
-            json.encoder.c_make_encoder = None
-            json.encoder.float = RoundingFloat
-            print(json.dumps(c.features, indent=4))
-    elif format == 'latex':        
+        _dump_json(c.features, pretty)
+    elif format == 'latex':
+        # pandas is only needed for the latex output and it is slow to import
+        import pandas as pd
         reformed_dict = {} 
         for outerKey, innerDict in c.features.items(): 
-            if type(innerDict) == dict:
+            if isinstance(innerDict, dict):
                 for innerKey, values in innerDict.items(): 
                     reformed_dict[(outerKey, innerKey)] = [values]
             else:
@@ -44,8 +73,8 @@ def instance_features(filename, format, pretty):
         print(df.to_latex(index=False))
 
 @cli.command()
-@click.argument('instance-filename', type=click.File())
-@click.argument('solution-filename', type=click.File())
+@click.argument('instance-filename', type=click.File('rb'))
+@click.argument('solution-filename', type=click.File('rb'))
 def validate_solution(instance_filename, solution_filename):
     try:
         i = Instance.model_validate_json(instance_filename.read())
@@ -60,8 +89,8 @@ def validate_solution(instance_filename, solution_filename):
         click.secho(f"{e}", fg='red')
 
 @cli.command()
-@click.argument('instance-filename', type=click.File())
-@click.argument('solution-filename', type=click.File())
+@click.argument('instance-filename', type=click.File('rb'))
+@click.argument('solution-filename', type=click.File('rb'))
 @click.option('--output', '-o', type=click.File('w'), default='-', help="Output file")
 def convert_solution(instance_filename, solution_filename, output):
     try:
@@ -78,28 +107,34 @@ def convert_solution(instance_filename, solution_filename, output):
 
     
 @cli.command()
-@click.argument('instance-filename', type=click.File())
-@click.argument('solution-filename', type=click.File())
+@click.argument('instance-filename', type=click.File('rb'))
+@click.argument('solution-filename', type=click.File('rb'))
 @click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), help="Output file")
-def plot_solution(instance_filename, solution_filename, output):
+@click.option('--latex', is_flag=True, show_default=True, default=False, help="Render the labels with LaTeX")
+@click.option('--rasterize', is_flag=True, show_default=True, default=False, help="Embed the bars and the arrows as images in vector outputs")
+def plot_solution(instance_filename, solution_filename, output, latex, rasterize):
     from .plot import plot
     i = Instance.model_validate_json(instance_filename.read())
-    s = Solution.model_validate_json(solution_filename.read())    
+    # the solution is only displayed, so its fields are not validated (the consistency with the instance is still checked)
+    s = Solution.from_trusted(json.loads(solution_filename.read()))
     s.check_validity(i)
-    plt = plot(i, s)
     if not output:
+        # the figure is only managed by pyplot when it has to be shown
+        import matplotlib.pyplot as plt
+        plot(i, s, use_latex=latex, rasterize=rasterize, figure=plt.figure())
         plt.show()
     else:
-        plt.savefig(output)
+        plot(i, s, use_latex=latex, rasterize=rasterize).savefig(output)
 
 @cli.command()
-@click.argument('instance-filename', type=click.File())
-@click.argument('solution-filename', type=click.File())
+@click.argument('instance-filename', type=click.File('rb'))
+@click.argument('solution-filename', type=click.File('rb'))
 @click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), help="Output file")
 def view_solution(instance_filename, solution_filename, output):
     from .interactive_visualizer import visualize
     i = Instance.model_validate_json(instance_filename.read())
-    s = Solution.model_validate_json(solution_filename.read())    
+    # the solution is only displayed, so its fields are not validated (the consistency with the instance is still checked)
+    s = Solution.from_trusted(json.loads(solution_filename.read()))
     s.check_validity(i)
     fig = visualize(i, s)
     if not output:
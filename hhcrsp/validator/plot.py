@@ -1,86 +1,175 @@
-import matplotlib.pyplot as plt
+import matplotlib
+import matplotlib.style
+from matplotlib.figure import Figure
 import matplotlib.patches as mpatches
 import matplotlib.cm as cm
+import matplotlib.patheffects as patheffects
+from matplotlib.collections import PolyCollection
 import numpy as np
 from ..models import Instance, Solution
 import re
+import functools
 
-plt.style.use('ggplot')
-plt.rcParams.update({
-    "text.usetex": True,
+# the style of the plot is only applied while building it, so that importing this module does not change the
+# global settings (i.e., the other figures of the process)
+_PLOT_STYLE = 'ggplot'
+_PLOT_RC = {
     "font.family": "CMS",
-    'font.size' : 14,
+    'font.size' : 14
+}
+
+# LaTeX is only used on request, since it runs an external process for each label; the preamble is read when the 
+# figure is drawn (i.e., possibly after plotting), hence these settings are applied globally
+_LATEX_RC = {
+    "text.usetex": True,
     "text.latex.preamble": r"\usepackage{fontawesome5}"
-})
+}
+
+# background of the service labels, as a semi-transparent white stroke shared by all of them (rather than a
+# rounded box patch for each label)
+_LABEL_EFFECTS = [patheffects.withStroke(linewidth=3, foreground=(1, 1, 1, 0.6))]
+
+# height of the depot rows, as far as the limits of the plot are concerned
+_DEPOT_HEIGHT = 0.1
+
+_LABEL_RE = re.compile(r'(\w)(\d+)')
+
+@functools.lru_cache(maxsize=1024)
+def _latexify_label(label):
+    # the ids repeat for each visit, hence the labels are cached
+    m = _LABEL_RE.match(label)
+    if not m:
+        return label
+    return f"${m.group(1)}_{{{m.group(2)}}}$"
+
+def _rectangles(left, width, bottom, height):
+    # vertices of axis-aligned rectangles, in the (n, 4, 2) layout expected by a PolyCollection
+    left, width, bottom, height = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (left, width, bottom, height)))
+    right, top = left + width, bottom + height
+    return np.stack([left, bottom, left, top, right, top, right, bottom], axis=-1).reshape(-1, 4, 2)
 
-def plot(instance: Instance, solution: Solution, patient_height : float = 0.3):
+# hatch and edge color of the services within, before and after the patient time window
+_SERVICE_HATCHES = ((None, 'gray'), (r'\\\\', 'white'), (r'////', 'white'))
+
+def _classify_visits(starts, time_windows):
+    # category of each visit, as an index of _SERVICE_HATCHES: 0 within the time window, 1 early and 2 late
+    return np.select([starts < time_windows[:, 0], starts > time_windows[:, 1]], [1, 2], 0)
+
+def plot(instance: Instance, solution: Solution, patient_height : float = 0.3, use_latex : bool = False, rasterize : bool = False, 
+         figure : Figure = None) -> Figure:
+    # with rasterize, the bars and the arrows are embedded as images in vector outputs (e.g., pdf or svg), while 
+    # the texts are kept as vectors; the plot is drawn on a new figure, not managed by pyplot (hence released as 
+    # soon as it is not referenced), unless a figure is given (e.g., a pyplot one, to show it)
+    if use_latex:
+        matplotlib.rcParams.update(_LATEX_RC)
+    with matplotlib.style.context(_PLOT_STYLE), matplotlib.rc_context(_PLOT_RC):
+        return _plot(instance, solution, patient_height, use_latex, rasterize, figure)
+
+def _plot(instance: Instance, solution: Solution, patient_height : float, use_latex : bool, rasterize : bool, figure : Figure):
     figsize = (12, patient_height * (len(instance.patients) + len(instance.departing_points)))
 
-    def select_hatch(p, served_patient):
-        if served_patient.start_service_time >= p.time_window[0] and served_patient.start_service_time <= p.time_window[1]:
-            return None
-        if served_patient.start_service_time < p.time_window[0]:
-            return r'\\\\'
-        else:
-            return r'////' 
-    
-    def select_hatch_color(p, served_patient):
-        if served_patient.start_service_time >= p.time_window[0] and served_patient.start_service_time <= p.time_window[1]:
-            return 'gray'    
-        else:
-            return 'white'
-        
-    def latexify_label(label):
-        m = re.match('(\w)(\d+)', label)
-        if not m:
-            return label
-        return f"${m.group(1)}_{{{m.group(2)}}}$"
-
-    _, ax = plt.subplots(1, figsize=figsize)
+    if figure is None:
+        figure = Figure(figsize=figsize)
+    else:
+        figure.set_size_inches(figsize)
+    ax = figure.subplots()
+    # the limits are set once at the end, rather than updated by each artist
+    ax.set_autoscale_on(False)
     
+    # the palette is interleaved (rather than shuffled), so that consecutive caregivers get distant colors 
+    # in a reproducible way and without touching the global random state
     palette = cm.viridis(np.linspace(0, 1, len(instance.caregivers)))
-    np.random.shuffle(palette)
-    c_dict = {f"{c.id}": palette[i] for i, c in enumerate(instance.caregivers)}
+    palette = np.concatenate([palette[::2], palette[1::2]])
+    # colors are looked up by caregiver position, so that whole color arrays can be gathered at once
+    caregiver_index = {c.id: i for i, c in enumerate(instance.caregivers)}
 
-    # setup departing points
-    for i, _ in enumerate(instance.departing_points):
-        ax.barh([f"$_{{{i}}}$" + r'\faWarehouse'], [0], left=[0], height=0.1, color="darkgray", align='center', zorder=1)
-    for p in instance.patients:
-        ax.barh([latexify_label(p.id)], [p.time_window[1] - p.time_window[0]], left=[p.time_window[0]], height=0.9 if len(p.required_services) > 1 else 0.45, color="darkgray", align='center', zorder=1)
+    # setup departing points and patients (i.e., the rows of the plot, labelled at their distance matrix index) and 
+    # the time windows, as a single collection of rectangles
+    depot_rows = np.array([dp.distance_matrix_index for dp in instance.departing_points], dtype=float)
+    patient_rows = np.array([p.distance_matrix_index for p in instance.patients], dtype=float)
+    ax.set_yticks(np.concatenate([depot_rows, patient_rows]), 
+                  [f"$_{{{i}}}$" + r'\faWarehouse' if use_latex else f"Depot$_{{{i}}}$" for i, _ in enumerate(instance.departing_points)] + 
+                  [_latexify_label(p.id) for p in instance.patients])
+    patient_windows = np.array([p.time_window for p in instance.patients], dtype=float).reshape(-1, 2)
+    heights = np.array([0.9 if len(p.required_services) > 1 else 0.45 for p in instance.patients])
+    ax.add_collection(PolyCollection(_rectangles(patient_windows[:, 0], patient_windows[:, 1] - patient_windows[:, 0], patient_rows - heights / 2, heights), 
+                                     facecolors="darkgray", zorder=1, rasterized=rasterize), autolim=False)
 
-    for r in solution.routes:
-        for visit in r._visits:
-            patient = instance._patients[visit.patient]
-            height = 0.4 if len(patient.required_services) == 1 else 0.4 if visit.service == patient.required_services[0].service else -0.4
-            align = 'center' if len(patient.required_services) == 1 else 'edge'
-            ax.barh([latexify_label(visit.patient)],
-                    [visit.end_service_time - visit.start_service_time], 
-                    left=[visit.start_service_time], 
-                    color=c_dict[r.caregiver_id], 
-                    height=height, 
-                    align=align, 
-                    hatch=[select_hatch(patient, visit)], 
-                    edgecolor=[select_hatch_color(patient, visit)])        
+    # local aliases of the instance indexes, and the vertical offset of each (patient, service) pair within the patient row
+    # (the first service of double service patients is drawn above the row center, the second one below it)
+    patients, departing_points, caregivers = instance._patients, instance._departing_points, instance._caregivers
+    offsets = { (p.id, s.service): 0 if len(p.required_services) == 1 else 0.2 if j == 0 else -0.2 
+                for p in instance.patients for j, s in enumerate(p.required_services) }
+
+    # the services are drawn as a single collection of rectangles for each hatch (i.e., for visits starting before, 
+    # within or after the time window), rather than as one bar each; the visits are flattened into arrays and 
+    # the hatches are selected through boolean masks
+    # the arrays are preallocated (the number of visits is known), and the patient data is gathered through 
+    # the positions of the visited patients, resolved when binding the routes to the instance
+    routes = [r.bind(instance) for r in solution.routes]
+    visits = [visit for r in routes for visit in r._visits]
+    starts = np.fromiter((visit.start_service_time for visit in visits), dtype=float, count=len(visits))
+    ends = np.fromiter((visit.end_service_time for visit in visits), dtype=float, count=len(visits))
+    colors = np.fromiter((caregiver_index[r.caregiver_id] for r in routes for _ in r._visits), dtype=np.int64, count=len(visits))
+    positions = np.concatenate([r._visits_position for r in routes]) if routes else np.empty(0, dtype=np.int64)
+    bottoms = patient_rows[positions] + np.fromiter((offsets[visit.patient, visit.service] for visit in visits), dtype=float, count=len(visits)) - 0.2
+    time_windows = patient_windows[positions]
+    categories = _classify_visits(starts, time_windows)
+    for category, (hatch, edgecolor) in enumerate(_SERVICE_HATCHES):
+        mask = categories == category
+        if mask.any():
+            ax.add_collection(PolyCollection(_rectangles(starts[mask], ends[mask] - starts[mask], bottoms[mask], 0.4), 
+                                             facecolors=palette[colors[mask]], edgecolors=edgecolor, hatch=hatch, 
+                                             rasterized=rasterize), autolim=False)
 
+    # the travels are collected and drawn at once as a single quiver, rather than as one annotation each
+    travels, travel_colors = [], []
+    # the waiting times are collected as well, and drawn with a single call
+    waits_left, waits_width, waits_bottom, waits_height, waits_color = [], [], [], [], []
+    text = ax.text
     for r in solution.routes:        
-        c = r.caregiver_id
-        prev = (r.locations[0].departing_time, instance._departing_points[instance._caregivers[c].departing_point].distance_matrix_index)
+        color = caregiver_index[r.caregiver_id]
+        depot = departing_points[caregivers[r.caregiver_id].departing_point].distance_matrix_index
+        prev = (r.locations[0].departing_time, depot)
         for visit in r._visits:
-            patient = instance._patients[visit.patient]
-            if len(patient.required_services) == 1:
-                offset = 0
-            elif visit.service == patient.required_services[0].service:
-                offset = 0.2
-            else:
-                offset = -0.2            
+            patient = patients[visit.patient]
+            offset = offsets[visit.patient, visit.service]
             cur = (visit.arrival_at_patient, patient.distance_matrix_index + offset)
-            ax.annotate('', xytext=cur, xy=prev, arrowprops=dict(arrowstyle="<-", color=c_dict[c], lw=2, alpha=0.6), zorder=0)             
-            ax.text(cur[0], cur[1], f'{latexify_label(visit.service)}', fontsize=7, bbox=dict(boxstyle="round", fc="w", alpha=0.6), ha='left', va='center')
-            ax.barh([latexify_label(visit.patient)], [visit.start_service_time - cur[0]], left=cur[0], height=offset * 2, align='center' if len(patient.required_services) == 1 else 'edge', color='white', hatch='ooo', alpha=0.3, edgecolor=c_dict[c], zorder=2)
+            travels.append(prev + cur)
+            travel_colors.append(color)
+            text(cur[0], cur[1], f'{_latexify_label(visit.service)}', fontsize=7, path_effects=_LABEL_EFFECTS, ha='left', va='center')
+            waits_left.append(cur[0])
+            waits_width.append(visit.start_service_time - cur[0])
+            waits_bottom.append(patient.distance_matrix_index)
+            waits_height.append(offset * 2)
+            waits_color.append(color)
             prev = (visit.end_service_time, patient.distance_matrix_index + offset)
-        cur = (r.locations[-1].arrival_time, instance._departing_points[instance._caregivers[c].departing_point].distance_matrix_index)
-        ax.annotate('', xytext=cur, xy=prev, arrowprops=dict(arrowstyle="<-", color=c_dict[c], lw=2, alpha=0.6))        
+        cur = (r.locations[-1].arrival_time, depot)
+        travels.append(prev + cur)
+        travel_colors.append(color)
+    if waits_left:
+        ax.barh(waits_bottom, waits_width, left=waits_left, height=waits_height, align='edge', color='white', hatch='ooo', alpha=0.3, edgecolor=palette[waits_color], zorder=2, rasterized=rasterize)
+    if travels:
+        travels = np.array(travels, dtype=float)
+        # the arrows span exactly from the departure to the arrival (in data coordinates), their width is in inches (i.e., 2 points)
+        ax.quiver(travels[:, 0], travels[:, 1], travels[:, 2] - travels[:, 0], travels[:, 3] - travels[:, 1], 
+                  color=palette[travel_colors], alpha=0.6, angles='xy', scale_units='xy', scale=1, 
+                  units='inches', width=2 / 72, headwidth=4, headlength=5, headaxislength=4.5, zorder=0, rasterized=rasterize)
+
+    # the limits span everything drawn (the depot rows as thin bars, the time windows, the services and the travels,
+    # including the returns to the depots), the time axis starts at 0 and both axes have the default margins
+    x_margin, y_margin = ax.margins()
+    x_extents = [patient_windows[:, 1], ends]
+    y_extents = [depot_rows - _DEPOT_HEIGHT / 2, depot_rows + _DEPOT_HEIGHT / 2, patient_rows - heights / 2, patient_rows + heights / 2, bottoms, bottoms + 0.4]
+    if len(travels):
+        x_extents += [travels[:, 0], travels[:, 2]]
+        y_extents += [travels[:, 1], travels[:, 3]]
+    x_max = max(values.max(initial=0) for values in x_extents)
+    y_min = min(values.min(initial=np.inf) for values in y_extents)
+    y_max = max(values.max(initial=-np.inf) for values in y_extents)
+    ax.set_xlim(0, x_max * (1 + x_margin))
+    ax.set_ylim(y_min - y_margin * (y_max - y_min), y_max + y_margin * (y_max - y_min))
 
-    plt.subplots_adjust(left=0.1, right=0.9, top=1, bottom=0)
-    plt.legend(handles=[mpatches.Patch(color=c_dict[c.id], label=latexify_label(c.id)) for c in instance.caregivers], loc='upper left', bbox_to_anchor=(1, 1))
-    return plt
\ No newline at end of file
+    figure.subplots_adjust(left=0.1, right=0.9, top=1, bottom=0)
+    ax.legend(handles=[mpatches.Patch(color=color, label=_latexify_label(c.id)) for c, color in zip(instance.caregivers, palette)], loc='upper left', bbox_to_anchor=(1, 1))
+    return figure
@@ -3,6 +3,26 @@ import pytest
 def test_dummy():
     assert True
 
+
 def test_failed_dummy():
      with pytest.raises(Exception):
-          assert False
\ No newline at end of file
+          assert False
+
+
+def test_pretty_json():
+    from hhcrsp.validator.cli import _pretty_json
+    value = { 'patients': { 'total': 25, 'single': 0.8 }, 'distances': { 'min': 1.0 }, 'empty': {} }
+    assert _pretty_json(value) == '{\n    "patients": {\n        "total": 25,\n        "single": 0.800\n    },\n    "distances": {\n        "min": 1.000\n    },\n    "empty": {}\n}'
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_dump_json_with_and_without_orjson(pretty, monkeypatch, capfd):
+    # the output is the same whether orjson is installed or not
+    pytest.importorskip('orjson')
+    from hhcrsp.validator import cli
+    value = { 'patients': { 'total': 25, 'single': 0.8 }, 'distances': { 'min': 1.0, 'avg': 2 / 3 } }
+    cli._dump_json(value, pretty)
+    with_orjson = capfd.readouterr().out
+    monkeypatch.setattr(cli, '_HAS_ORJSON', False)
+    cli._dump_json(value, pretty)
+    assert capfd.readouterr().out == with_orjson
@@ -0,0 +1,134 @@
+import pytest
+import numpy as np
+from pydantic import ValidationError
+from hhcrsp.models import Instance, Solution
+
+def make_instance(synchronization):
+    return Instance.model_validate({
+        'name': 'test',
+        'area': [0.0, 0.0, 1.0, 1.0],
+        'departing_points': [{ 'id': 'd0' }],
+        'caregivers': [
+            { 'id': 'c0', 'abilities': ['s0'], 'departing_point': 'd0', 'working_shift': [0, 100] },
+            { 'id': 'c1', 'abilities': ['s1'], 'departing_point': 'd0', 'working_shift': [0, 100] }
+        ],
+        'patients': [
+            { 'id': 'p0', 'time_window': [0, 100], 'synchronization': synchronization,
+              'required_services': [{ 'service': 's0' }, { 'service': 's1' }] }
+        ],
+        'services': [
+            { 'id': 's0', 'type': 't0', 'default_duration': 5 },
+            { 'id': 's1', 'type': 't1', 'default_duration': 5 }
+        ],
+        'distances': [[0, 2], [2, 0]]
+    })
+
+def make_solution(first_start, second_start):
+    return Solution.model_validate({
+        'routes': [
+            { 'caregiver_id': 'c0', 'locations': [{ 'patient': 'p0', 'service': 's0', 'start_service_time': first_start, 'end_service_time': first_start + 5 }] },
+            { 'caregiver_id': 'c1', 'locations': [{ 'patient': 'p0', 'service': 's1', 'start_service_time': second_start, 'end_service_time': second_start + 5 }] }
+        ]
+    })
+
+def test_simultaneous_services():
+    instance = make_instance({ 'type': 'simultaneous' })
+    make_solution(10, 10).check_validity(instance)
+
+def test_simultaneous_services_not_provided_simultaneously():
+    instance = make_instance({ 'type': 'simultaneous' })
+    with pytest.raises(AssertionError, match='not provided simultaneously'):
+        make_solution(10, 12).check_validity(instance)
+
+def test_sequential_services():
+    instance = make_instance({ 'type': 'sequential', 'distance': [2, 4] })
+    make_solution(10, 13).check_validity(instance)
+    with pytest.raises(AssertionError, match='too early'):
+        make_solution(10, 11).check_validity(instance)
+    with pytest.raises(AssertionError, match='too late'):
+        make_solution(10, 15).check_validity(instance)
+
+def test_instance_equality():
+    assert make_instance({ 'type': 'simultaneous' }) == make_instance({ 'type': 'simultaneous' })
+    assert make_instance({ 'type': 'simultaneous' }) != make_instance({ 'type': 'sequential', 'distance': [2, 4] })
+
+def make_instance_data(distances):
+    data = make_instance({ 'type': 'simultaneous' }).model_dump(exclude={ 'signature' }, exclude_none=True)
+    data['distances'] = distances
+    return data
+
+@pytest.mark.parametrize('distances, message', [
+    ([[0, 2], [2]], 'Row 1 of the distance matrix has 1 columns'),
+    ([[0, 2.5], [2, 0]], 'should be integer numbers'),
+    ([[0, 2], [2, 2 ** 31]], 'should be in the range')
+])
+def test_distance_matrix_rejected(distances, message):
+    with pytest.raises(ValidationError, match=message):
+        Instance.model_validate(make_instance_data(distances))
+
+def test_distance_matrix_integer_floats():
+    instance = Instance.model_validate(make_instance_data([[0.0, 2.0], [2.0, 0.0]]))
+    assert instance.distances.dtype == np.int32
+    assert instance == make_instance({ 'type': 'simultaneous' })
+
+def test_signature_of_updated_copy():
+    instance = make_instance({ 'type': 'simultaneous' })
+    signature = instance.signature
+    copy = instance.model_copy(update={ 'name': 'other' })
+    assert copy.signature != signature
+    assert copy.signature == Instance.model_validate(copy.model_dump(exclude={ 'signature' }, exclude_none=True)).signature
+    assert instance.model_copy().signature == instance.signature
+
+def test_features_of_updated_copy():
+    instance = make_instance({ 'type': 'simultaneous' })
+    features = instance.features
+    copy = instance.model_copy(update={ 'caregivers': instance.caregivers[:1] })
+    assert copy.features['caregivers'] == 1
+    assert copy.features['compatible_caregivers']['min'] == 0
+    assert instance.features == features
+    assert [s._compatible_caregivers for s in instance.patients[0].required_services] == [1, 1]
+
+@pytest.mark.parametrize('field, index, key, value, message', [
+    ('patients', 0, 'required_services', [{ 'service': 'nope' }], 'Service nope required by patient p0'), 
+    ('caregivers', 0, 'departing_point', 'nope', 'Departing point nope of caregiver c0')
+])
+def test_unchecked_cross_references(field, index, key, value, message):
+    data = make_instance_data([[0, 2], [2, 0]])
+    data[field][index][key] = value
+    with pytest.raises(ValidationError, match=message):
+        Instance.model_validate(data, context={ 'check_cross_references': False })
+    with pytest.raises(ValueError, match=message):
+        Instance.from_trusted(data)
+
+def test_costs_types():
+    instance = make_instance({ 'type': 'simultaneous' })
+    solution = make_solution(10, 10)
+    solution.check_validity(instance)
+    costs = solution.compute_costs(instance)
+    empty_costs = Solution.model_validate({ 'routes': [] }).compute_costs(instance)
+    assert { k: type(v) for k, v in empty_costs.items() } == { k: type(v) for k, v in costs.items() }
+    assert all(type(v) is int for v in empty_costs.values())
+
+def test_null_time_window():
+    data = make_instance_data([[0, 2], [2, 0]])
+    data['patients'][0]['time_window'] = None
+    instance = Instance.model_validate(data)
+    assert Instance.from_trusted(data, check=True) == instance
+    with pytest.raises(ValueError, match='Patient p0 has no time window'):
+        instance.features
+
+def test_time_window_overflow():
+    data = make_instance_data([[0, 2], [2, 0]])
+    data['patients'][0]['time_window'] = [0, 2 ** 31]
+    with pytest.raises(ValueError, match='time windows should be in the range'):
+        Instance.model_validate(data).features
+
+def test_signature_format():
+    # the signature identifies the instances, so its value should not change across versions (or runs)
+    data = make_instance_data([[0, 2], [2, 0]])
+    data['caregivers'] += [{ 'id': f'c{i}', 'abilities': ['s0'], 'departing_point': 'd0', 'working_shift': [0, 100] } for i in (2, 3, 4)]
+    data['patients'][0]['incompatible_caregivers'] = ['c4', 'c2', 'c3']
+    instance = Instance.model_validate(data)
+    data['patients'][0]['incompatible_caregivers'] = ['c3', 'c4', 'c2']
+    assert Instance.model_validate(data).signature == instance.signature
+    assert instance.signature == '4153623912b8d18ff2307efb0e5ef594b611a9b83dff827bb85d102a217fddfa'